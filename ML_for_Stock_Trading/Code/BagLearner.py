@@ -5,14 +5,25 @@ How to use:
     import BagLearner as bl
     learner = bl.BagLearner(learner = al.ArbitraryLearner, kwargs = {"argument1":1, "argument2":2}, bags = 20, boost = False, verbose = False)
     learner.add_evidence(Xtrain, Ytrain)
+    learner.compile() # optional, pack all trees into one forest for faster queries
     Y = learner.query(Xtest)
+    leaves = learner.apply(Xtest) # leaf of every row in every bag, shaped (rows, bags)
+    learner.update(Xnew, Ynew) # online bagging, members built with kwargs {"incremental": True}
+    learner = bl.BagLearner(rt.RTLearner, {}, 20, profile = pf.Profile()) # per-bag times and build phases, see profiling.py
 """
+import inspect
+import os
+import time
 import numpy as np
-from scipy import stats
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import TreeModel as tm
+import profiling as pf
 
 class BagLearner(object):  		   	  			  	 		  		  		    	 		 		   		 		  
   		   	  			  	 		  		  		    	 		 		   		 		  
-    def __init__(self, learner, kwargs, bags, boost=False, verbose=False):
+    def __init__(self, learner, kwargs, bags, boost=False, verbose=False, n_jobs=1, chunk_size=10000,
+                 oob=False, oob_tol=None, oob_window=5, profile=None):
 
         """
         Hints from project description:
@@ -22,6 +33,8 @@ class BagLearner(object):
             learners.append(learner(**kwargs))
         """
 
+        self.learner = learner
+        self.kwargs = kwargs
         self.learners = []
         for i in np.arange(bags):
             self.learners.append(learner(**kwargs))
@@ -29,6 +42,14 @@ class BagLearner(object):
         self.bags = bags 
         self.verbose = verbose
         self.boost = boost
+        self.n_jobs = n_jobs # processes training bags / threads querying, -1 for all cores
+        self.chunk_size = chunk_size # rows scored at a time by query
+        self.forest = None # all trees packed into one TreeModel by compile()
+        self.oob = oob # score each bag on the rows its bootstrap left out
+        self.oob_tol = oob_tol # stop adding bags once the out-of-bag accuracy moves less than this
+        self.oob_window = oob_window # ... over this many bags
+        self.oob_curve = [] # out-of-bag accuracy of the first 1, 2, ... bags
+        self.profile = profile # profiling.Profile with per-bag times and the members' build phases
 
         if self.verbose and self.boost:
             print('Note: boosting is not supported')
@@ -38,23 +59,293 @@ class BagLearner(object):
         return 'kgao47'
 	 		  		  		    	 		 		   		 		  
     def addEvidence(self,data_x,data_y):
-        nrec = np.shape(data_x)[0]
-        for i in np.arange(self.bags):
-            index_sel = np.random.choice(nrec, nrec, replace=True) # some records repeated
-            data_x_sel = data_x[index_sel, :]
-            data_y_sel = data_y[index_sel]
+        """
+        Train every bag on its own bootstrap sample of the data
+        Note: the bootstrap samples of all bags are drawn up front as row indices
+        (see draw_bootstrap). Learners whose addEvidence takes rows train on the data
+        in place through them, others get a copy of their sample. Each bag also
+        reseeds np.random with its own seed before training, so results only
+        depend on the caller's seed, not on n_jobs. With n_jobs > 1 the data and
+        the indices are placed in shared memory once and the bags are trained in
+        a process pool.
+        Note: with oob=True (or oob_tol set) oob_curve[k] is the out-of-bag accuracy
+        of the first k+1 bags, each row being scored only by the bags whose
+        bootstrap did not draw it. With oob_tol set, training stops as soon as
+        the curve moved by at most oob_tol over the last oob_window bags and the
+        ensemble keeps only the bags trained so far.
+        """
+        dtype = getattr(self.learners[0], 'dtype', None) if self.learners else None
+        if dtype is not None: # convert once for all bags (and the shared memory), not once per bag
+            data_x = np.asarray(data_x, dtype=dtype)
+        self.classes = np.unique(data_y) # labels the bags vote for
+        self.forest = None
+        while len(self.learners) < self.bags: # a previous fit may have stopped early
+            self.learners.append(self.learner(**self.kwargs))
+        track = self.oob or self.oob_tol is not None
+        if self.profile is not None: # each bag profiles itself, merged in collect_bags
+            for learner in self.learners:
+                if hasattr(learner, 'profile'):
+                    learner.profile = pf.Profile()
+        seeds, index = draw_bootstrap(self.bags, np.shape(data_x)[0])
+        n_jobs = n_workers(self.n_jobs)
+        if n_jobs <= 1 or self.bags <= 1:
+            state = np.random.get_state()
+            results = (train_bag(self.learners[i], data_x, data_y, index[i], seeds[i], i, self.verbose, track)
+                       for i in np.arange(self.bags)) # lazy, so stopping early skips the rest
+            self.collect_bags(results, data_y)
+            np.random.set_state(state)
+            return
+
+        blocks = []
+        try:
+            specs = []
+            for arr in (np.ascontiguousarray(data_x), np.ascontiguousarray(data_y), index):
+                shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                blocks.append(shm)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                specs.append((shm.name, arr.shape, arr.dtype.str))
+            with ProcessPoolExecutor(max_workers=min(n_jobs, self.bags), initializer=attach_shared,
+                                     initargs=(specs,)) as pool:
+                jobs = [pool.submit(train_shared_bag, self.learners[i], seeds[i], i, self.verbose, track)
+                        for i in np.arange(self.bags)]
+                self.collect_bags((job.result() for job in jobs), data_y)
+                for job in jobs:
+                    job.cancel()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def collect_bags(self, results, data_y):
+        """
+        Keep the trained bags in order, updating the out-of-bag accuracy after each one
+        results: iterable of (learner, oob_pred, seconds) as returned by train_bag
+        """
+        learners = []
+        self.oob_curve = []
+        n_class = len(self.classes)
+        votes = np.zeros((len(data_y), n_class), dtype=np.int64)
+        for learner, oob_pred, seconds in results:
+            learners.append(learner)
+            if self.profile is not None:
+                self.profile.bag_times.append(seconds)
+                if getattr(learner, 'profile', None) is not None:
+                    self.profile.merge(learner.profile)
+            if oob_pred is None:
+                continue
+            out = np.flatnonzero(~np.isnan(oob_pred))
+            code = np.searchsorted(self.classes, oob_pred[out])
+            votes.ravel()[out * n_class + code] += 1
+            scored = np.any(votes > 0, axis=1)
+            pred = self.classes[np.argmax(votes[scored], axis=1)]
+            accuracy = np.mean(pred == data_y[scored])
+            self.oob_curve.append(accuracy)
             if self.verbose:
-                print('--- selecting a random portion of training dataset for bag', i)
-                print('index:', index_sel)
-                print('shape of data_x:', np.shape(data_x_sel))
-                print('shape of data_y:', np.shape(data_y_sel))
-            self.learners[i].addEvidence(data_x_sel,data_y_sel)
-
-    def query(self, points):
-        pred_all = []
-        for i in np.arange(self.bags):
-            pred_all.append(self.learners[i].query(points))
-        pred_all = np.array(pred_all)
-        #pred = np.mean(pred_all, axis=0) 
-        pred = stats.mode(pred_all)[0][0] #use mode for classification
+                print('--- out-of-bag accuracy with', len(learners), 'bags:', accuracy)
+            if self.oob_flat():
+                break
+        self.learners = learners
+
+    def oob_flat(self):
+        """
+        Return: True once early stopping is on and the last oob_window bags moved
+        the out-of-bag curve by at most oob_tol
+        """
+        curve = self.oob_curve
+        if self.oob_tol is None or len(curve) <= self.oob_window:
+            return False
+        return abs(curve[-1] - curve[-1 - self.oob_window]) <= self.oob_tol
+
+    def trees(self):
+        """
+        Return: the TreeModel held by each bag (None for learners that are not trees)
+        """
+        return [getattr(learner, 'tree', None) for learner in self.learners]
+
+    def update(self, new_x, new_y):
+        """
+        Add training rows to every bag without retraining (online bagging)
+        new_x, new_y: the new records, as for addEvidence
+        Note: each bag takes every new row k times with k drawn from Poisson(1),
+        the limit of how often a bootstrap sample of a large dataset repeats a
+        row, so the bags stay close to bootstraps of all the data seen so far.
+        The members need an update method (e.g. trees built with incremental=True).
+        A compiled forest is rebuilt afterwards.
+        """
+        self.classes = np.union1d(self.classes, new_y)
+        index = np.arange(len(new_y))
+        for learner in self.learners:
+            index_sel = np.repeat(index, np.random.poisson(1, len(new_y)))
+            if len(index_sel) > 0:
+                learner.update(new_x[index_sel], new_y[index_sel])
+        if self.forest is not None:
+            self.compile()
+
+    def compile(self):
+        """
+        Pack the trees of all bags into a single TreeModel with one root per bag,
+        so query moves every (tree, row) pair through the forest in one pass
+        Return: True if every bag holds a tree and the forest was built
+        """
+        trees = self.trees()
+        if len(trees) == 0 or any(tree is None for tree in trees):
+            self.forest = None
+            return False
+        self.forest = tm.TreeModel.concatenate(trees)
+        return True
+
+    def apply(self, points):
+        """
+        Find the leaf each row ends up in, in every bag
+        points: a numpy array with each row corresponding to a specific query.
+        return: (rows, bags) int32 array, column i holding node indices into the
+            tree of bag i (as its learner's apply would return)
+        Note: after compile() all bags are walked at once through the packed forest
+        """
+        if self.forest is not None:
+            nodes = self.forest.apply(points).reshape(len(self.forest.roots), -1)
+            return (nodes - self.forest.roots[:, None]).T.astype(np.int32)
+        return np.column_stack([learner.apply(points) for learner in self.learners]).astype(np.int32)
+
+    def query(self, points, return_fractions=False):
+        """
+        Majority vote of all bags (mode for classification, ties go to the smallest label)
+        points: a numpy array with each row corresponding to a specific query.
+        return_fractions: also return the share of the bags voting for each label
+        return: the predicted labels, and with return_fractions a (rows, labels)
+            array of vote fractions, columns in the order of self.classes
+        Note: rows are scored chunk_size at a time keeping only per-class vote
+        counts, so memory grows with the chunk instead of bags x rows. With
+        n_jobs > 1 the chunks are spread over a thread pool. After compile() the
+        packed forest is used and chunk_size counts (tree, row) pairs instead of rows.
+        """
+        since = time.perf_counter()
+        nrec = np.shape(points)[0]
+        pred = np.empty(nrec)
+        step = self.chunk_size
+        if self.forest is not None: # chunk_size counts (tree, row) pairs
+            step = max(self.chunk_size // len(self.forest.roots), 1)
+        n_class = len(self.classes)
+        n_trees = len(self.forest.roots) if self.forest is not None else len(self.learners)
+        fractions = np.empty((nrec, n_class)) if return_fractions else None
+
+        def score(start):
+            chunk = points[start:start + step]
+            m = np.shape(chunk)[0]
+            votes = np.zeros(m * n_class, dtype=np.int64)
+            slots = np.arange(m) * n_class
+            if self.forest is not None:
+                code = np.searchsorted(self.classes, self.forest.query(chunk))
+                votes += np.bincount((slots + code).ravel(), minlength=m * n_class)
+            else:
+                for learner in self.learners:
+                    code = np.searchsorted(self.classes, learner.query(chunk))
+                    votes += np.bincount(slots + code, minlength=m * n_class)
+            votes = votes.reshape(m, n_class)
+            pred[start:start + m] = self.classes[np.argmax(votes, axis=1)]
+            if fractions is not None:
+                fractions[start:start + m] = votes / float(n_trees)
+
+        self.map_chunks(score, nrec, step)
+        if self.profile is not None:
+            self.profile.lap('query', since)
+            self.profile.query_rows += nrec
+        if return_fractions:
+            return pred, fractions
         return pred
+
+    def map_chunks(self, score, nrec, step):
+        """
+        Call score(start) for the first row of every chunk of step rows, on a
+        thread pool if n_jobs > 1
+        """
+        starts = range(0, nrec, step)
+        n_jobs = n_workers(self.n_jobs)
+        if n_jobs <= 1 or len(starts) <= 1:
+            for start in starts:
+                score(start)
+        else:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(starts))) as pool:
+                list(pool.map(score, starts))
+
+
+def n_workers(n_jobs):
+    """
+    Return: the number of workers to use for n_jobs (-1 means one per core)
+    """
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    return max(int(n_jobs or 1), 1)
+
+
+def draw_bootstrap(bags, nrec):
+    """
+    Draw the bootstrap samples of all bags with one call to np.random
+    Return: (seeds, index), one seed per bag (reseeds np.random before the bag
+        trains, for the learner's own randomness) and a (bags, nrec) int32 array
+        with the records of each bag's sample, drawn with replacement
+    """
+    seeds = np.random.randint(0, 2**31 - 1, size=bags)
+    index = np.random.randint(0, nrec, size=(bags, nrec), dtype=np.int32)
+    return seeds, index
+
+
+def takes_rows(fit):
+    """
+    Return: True if the training method fit accepts a rows argument
+    """
+    try:
+        return 'rows' in inspect.signature(fit).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def train_bag(learner, data_x, data_y, index_sel, seed, i=0, verbose=False, oob=False):
+    """
+    Train one bag on the bootstrap sample index_sel (records of data_x, some repeated)
+    Return: (learner, oob_pred, seconds), the trained learner, if oob its predictions
+        for the rows left out of the sample (nan for rows in the sample), and the
+        time taken by training
+    Note: learners taking rows train on data_x in place, others on a copy of the sample
+    """
+    since = time.perf_counter()
+    np.random.seed(seed)
+    nrec = np.shape(data_x)[0]
+    if verbose:
+        print('--- bag', i, ': training on', len(index_sel), 'records drawn with replacement,',
+              len(np.unique(index_sel)), 'distinct')
+    if takes_rows(learner.addEvidence):
+        learner.addEvidence(data_x, data_y, rows=index_sel)
+    else:
+        learner.addEvidence(data_x[index_sel], data_y[index_sel])
+    seconds = time.perf_counter() - since
+    if not oob:
+        return learner, None, seconds
+    out = np.ones(nrec, dtype=bool)
+    out[index_sel] = False
+    oob_pred = np.full(nrec, np.nan)
+    if np.any(out):
+        oob_pred[out] = learner.query(data_x[out])
+    return learner, oob_pred, seconds
+
+
+_shared = [] # (SharedMemory, array) pairs attached by a pool worker
+
+
+def attach_shared(specs):
+    """
+    Pool initializer: map the training arrays published by the parent process
+    specs: list of (shared memory name, shape, dtype) for data_x, data_y and the bootstrap index
+    """
+    del _shared[:]
+    for name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        _shared.append((shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)))
+
+
+def train_shared_bag(learner, seed, i=0, verbose=False, oob=False):
+    """
+    Pool task: train one bag on the arrays mapped by attach_shared
+    """
+    data_x, data_y, index = [arr for shm, arr in _shared]
+    return train_bag(learner, data_x, data_y, index[i], seed, i, verbose, oob)
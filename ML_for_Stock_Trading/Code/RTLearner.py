@@ -6,17 +6,34 @@ How to use:
     learner = rt.RTLearner(leaf_size = 1, verbose = False) # constructor
     learner.add_evidence(Xtrain, Ytrain) # training step
     Y = learner.query(Xtest) # query
+    leaves = learner.apply(Xtest) # leaf node index of every row
+    learner.update(Xnew, Ynew) # add rows without retraining, needs incremental = True
+    learner = rt.RTLearner(leaf_size = 1, profile = pf.Profile()) # per-phase timings in learner.profile, see profiling.py
+    learner = rt.RTLearner(leaf_size = 1, dtype = np.float32) # train and query in float32
+    learner = rt.RTLearner(leaf_size = 1, split = 'random') # extra-trees split values, faster to train
 """
 
+import time
 import numpy as np
-from scipy import stats
+import treeutil as tu
 
   		   	  			  	 		  		  		    	 		 		   		 		  
 class RTLearner(object):
   		   	  			  	 		  		  		    	 		 		   		 		  
-    def __init__(self, leaf_size=1, verbose=False):
+    def __init__(self, leaf_size=1, verbose=False, incremental=False, split_factor=2, keep_leaves=False, profile=None,
+                 dtype=np.float64, split='median'):
         self.leaf_size = leaf_size	
         self.verbose = verbose
+        self.incremental = incremental # keep the training rows so update() can add more
+        self.split_factor = split_factor # update() regrows leaves past leaf_size x split_factor rows
+        self.updater = None
+        self.keep_leaves = keep_leaves # remember the leaf of every training row, see apply
+        self.train_leaves = None
+        self.profile = profile # profiling.Profile collecting build and query timings, None for off
+        self.dtype = np.dtype(dtype) # float32 halves the data copies and the tree, see addEvidence
+        if split not in ('median', 'random'):
+            raise ValueError("split must be 'median' or 'random', not %r" % (split,))
+        self.split = split # 'random': split at the mean of two random records' values instead of the median
         if self.verbose:
             print('You are using the Random Tree Learner')
             print('The leaf size is', self.leaf_size)
@@ -32,44 +49,95 @@ class RTLearner(object):
         _, total_idx = np.shape(x)
         return np.random.randint(0,total_idx)
 
-    def addEvidence(self, data_x, data_y):
+    @staticmethod
+    def mode(y):
+        """
+        Most common label in y, the prediction of a leaf (ties go to the smallest
+        label, as with scipy.stats.mode)
+        """
+        classes, code = np.unique(y, return_inverse=True)
+        return classes[np.argmax(np.bincount(code))]
+
+    def addEvidence(self, data_x, data_y, rows=None):
         """
         Add training data to learner
         data_x: A set of feature values used to train the learner
         data_y: The value we are attempting to predict given the X data
+        rows: indices of the records to train on (repeats allowed, e.g. a bootstrap
+            sample), None for all; the tree reads them in place instead of copying
+        Note: the features are converted to dtype first (no copy if they already
+        are), so with float32 the medians and the tree are float32 too and query
+        compares in float32; the labels are kept as given
         """
-        self.tree = self.build_tree(data_x, data_y)
+        data_x = np.asarray(data_x, dtype=self.dtype)
+        self.tree, leaves = self.build_tree(data_x, data_y, return_leaves=True, rows=rows)
+        self.train_leaves = leaves if self.keep_leaves else None
+        self.updater = None
+        if self.incremental:
+            if rows is not None: # the updater keeps its own copy of the rows anyway
+                data_x, data_y = data_x[rows], data_y[rows]
+            self.updater = tu.TreeUpdater(self.tree, data_x, data_y, self.leaf_size, self.split_factor, leaves)
 
-    def build_tree(self, data_x, data_y):
+    def update(self, new_x, new_y):
+        """
+        Add training rows to the trained tree without rebuilding it
+        new_x, new_y: the new records, as for addEvidence
+        Note: the new rows only touch the leaves they reach; a leaf that grows
+        past leaf_size x split_factor rows is replaced by a subtree grown from its rows
+        """
+        if self.updater is None:
+            raise ValueError('update needs a tree trained by addEvidence with incremental=True')
+        self.updater.update(np.asarray(new_x, dtype=self.dtype), new_y, self.feature_finder, leaf_value=self.mode,
+                            split_value=self.split_value())
+
+    def build_tree(self, data_x, data_y, return_leaves=False, rows=None):
         """
         Build a decision tree based on the algorithm in Balch slides
-        Return: a 2-dim array describing the tree
-        Note: the number -999 is used to represent a 'leaf' node
-        """
-        if data_x.shape[0] <= self.leaf_size: # if all data can fit in the same leaf
-            #return np.array([[-999, np.mean(data_y), np.nan, np.nan]])
-            return np.array([[-999, stats.mode(data_y,axis=None)[0][0], np.nan, np.nan]])
-        elif np.max(data_y) == np.min(data_y): # if all labels are the same
-            return np.array([[-999, data_y[0], np.nan, np.nan]])
-        else:
-            # find a random feature i to split on
-            idx = self.find_feature_idx(data_x)
-            SplitVal = np.median(data_x[:,idx])
+        Return: a TreeModel describing the tree (to_array() gives the old 2-dim array),
+            and with return_leaves the leaf of every training row
+        """
+        # leaves vote with integer class codes, decoded back to labels once at the end
+        classes, codes = np.unique(data_y, return_inverse=True)
+        leaf_code = lambda code: np.argmax(np.bincount(code))
+        tree, leaves = tu.build_tree(data_x, codes, self.leaf_size, self.feature_finder(data_x),
+                                     leaf_value=leaf_code, return_leaves=True, rows=rows, profile=self.profile,
+                                     split_value=self.split_value())
+        leaf = tree.leaf
+        tree.value[leaf] = classes[tree.value[leaf].astype(np.intp)]
+        if return_leaves:
+            return tree, leaves
+        return tree
 
-            data_x_left = data_x[data_x[:,idx] <= SplitVal]
-            data_y_left = data_y[data_x[:,idx] <= SplitVal]
-            data_x_right = data_x[data_x[:,idx] > SplitVal]
-            data_y_right = data_y[data_x[:,idx] > SplitVal]
+    def split_value(self):
+        """
+        Return: the split_value callable tu.build_tree uses, the median or, with
+            split='random', the mean of two randomly drawn records (O(1) per node)
+        """
+        return tu.random_split_value if self.split == 'random' else np.median
+
+    def feature_finder(self, data_x):
+        """
+        Return: the find_feature callable tu.build_tree uses on data_x
+        """
+        # find a random feature i to split on at each node
+        return lambda rows, ys: self.find_feature_idx(data_x)
 
-            if len(data_y_right) == 0: # all data on the same side
-                #return np.array([[-999, np.mean(data_y_left), np.nan, np.nan]])
-                return np.array([[-999, stats.mode(data_y_left,axis=None)[0][0], np.nan, np.nan]])
-            else: # ok, needs recursion
-                left = self.build_tree(data_x_left, data_y_left)
-                right= self.build_tree(data_x_right,data_y_right)
-                root = np.array([[idx, SplitVal, 1, np.shape(left)[0]+1]])
-                combined = np.vstack((root, left, right))
-                return combined
+    def apply(self, points=None):
+        """
+        Find the leaf each row ends up in, with the same batched traversal as query
+        points: a numpy array with each row corresponding to a specific query, or
+            None for the training rows (kept at training time with keep_leaves=True,
+            or tracked through update() with incremental=True; no traversal)
+        return: int32 array with the node index of the leaf of every row, so
+            self.tree.value[leaves] are the predictions
+        """
+        if points is not None:
+            return self.tree.apply(points).astype(np.int32)
+        if self.updater is not None:
+            return self.updater.leaves()
+        if self.train_leaves is None:
+            raise ValueError('apply() without points needs keep_leaves=True or incremental=True')
+        return self.train_leaves
 
     def query(self, points):
         """
@@ -77,20 +145,13 @@ class RTLearner(object):
         points: a numpy array with each row corresponding to a specific query.
         return: the predicted result of the input data according to the trained model
         """
-        nrec,_ = np.shape(points)
-        pred_all = np.zeros(nrec) # output
-
-        for i in np.arange(nrec):
-            one_entry = points[i,:]
-            ti = 0
-            while self.tree[ti][0] > -900: # if not a leaf
-                if one_entry[np.int(self.tree[ti][0])] <= self.tree[ti][1]:
-                    ti += np.int(self.tree[ti][2]) # left
-                else:
-                    ti += np.int(self.tree[ti][3]) # right
-            pred_all[i] = self.tree[ti][1]
-
-        return pred_all
+        if self.profile is None:
+            return self.tree.query(points)
+        since = time.perf_counter()
+        result = self.tree.query(points)
+        self.profile.lap('query', since)
+        self.profile.query_rows += len(points)
+        return result
 
 if __name__ == "__main__":
     print("Main")
\ No newline at end of file
@@ -3,7 +3,10 @@ Usage
 - Format:
     import StrategyLearner as sl
     learner = sl.StrategyLearner(verbose = False, impact = 0.0, commission=0.0) # constructor
+    learner = sl.StrategyLearner(impact = 0.0, split = 'random') # random trees with extra-trees split values, faster to train
+    learner = sl.StrategyLearner(impact = 0.0, incremental = True) # keeps the training rows so update() can add days
     learner.add_evidence(symbol = "AAPL", sd=dt.datetime(2008,1,1), ed=dt.datetime(2009,12,31), sv = 100000) # training phase
+    learner.update(symbol = "AAPL", sd=dt.datetime(2008,1,1), ed=dt.datetime(2010,1,15), sv = 100000) # add the new days, no retraining
     df_trades = learner.testPolicy(symbol = "AAPL", sd=dt.datetime(2010,1,1), ed=dt.datetime(2011,12,31), sv = 100000) # testing phase
     
 - For classification, you must convert your regression learner to use mode rather than mean (RTLearner, BagLearner)
@@ -26,7 +29,7 @@ class StrategyLearner(object):
     def author(self):
         return 'kgao47'
 
-    def __init__(self, verbose=False, impact=0., commission=0.):
+    def __init__(self, verbose=False, impact=0., commission=0., split='median', incremental=False):
         self.verbose = verbose
         self.impact = impact
         self.commission = commission
@@ -36,7 +39,11 @@ class StrategyLearner(object):
         self.lookback = 14 # for calculating indicators
         self.lookahead = 5 # for creating training Y
         
-        self.learner = bl.BagLearner(learner = rt.RTLearner, kwargs = {"leaf_size":5}, bags=30, boost = False, verbose = False)
+        self.last_trained = None # date of the last training row, see update
+        
+        self.split = split # split values of the random trees, 'median' or 'random' (see RTLearner)
+        self.incremental = incremental # every bag keeps a copy of its training rows for update
+        self.learner = bl.BagLearner(learner = rt.RTLearner, kwargs = {"leaf_size":5, "incremental":incremental, "split":split}, bags=30, boost = False, verbose = False)
 
     @staticmethod
     def createX(prices, syms, lookback):
@@ -49,6 +56,19 @@ class StrategyLearner(object):
         indicators.fillna(0,inplace=True)
         return indicators.values
 
+    @staticmethod
+    def createY(prices, lookahead, ybuy, ysell):
+        Y=[]
+        for i in np.arange(prices.shape[0]-lookahead):
+            ratio = (prices.iloc[i+lookahead,0]-prices.iloc[i,0])/prices.iloc[i,0]
+            if ratio > ybuy:
+                Y.append(1)
+            elif ratio < ysell:
+                Y.append(-1)
+            else:
+                Y.append(0)
+        return np.array(Y)
+
     @staticmethod
     def create_trades(prices, Y):
         trades = prices.copy()
@@ -99,19 +119,37 @@ class StrategyLearner(object):
         trainX = trainX[:-self.lookahead]
         
         # --- Prepare training Y
-        trainY=[]
-        for i in np.arange(prices.shape[0]-self.lookahead):
-            ratio = (prices.iloc[i+self.lookahead,0]-prices.iloc[i,0])/prices.iloc[i,0]
-            if ratio > self.ybuy:
-                trainY.append(1)
-            elif ratio < self.ysell:
-                trainY.append(-1)
-            else:
-                trainY.append(0)
-        trainY=np.array(trainY)
+        trainY = self.createY(prices, self.lookahead, self.ybuy, self.ysell)
 
         # --- Train learner
         self.learner.addEvidence(trainX,trainY)
+        self.learner.compile() # testPolicy rescores with the packed forest
+        self.last_trained = prices.index[len(trainY)-1]
+
+    def update(self, symbol = "IBM", \
+        sd=dt.datetime(2008,1,1), \
+        ed=dt.datetime(2009,1,1), \
+        sv = 10000):
+        """
+        Add the trading days after the last one trained on, without retraining
+        sd, ed: price window the indicators and labels are computed on; start it
+            early enough to warm up the lookback (e.g. at the training start)
+        Note: a day becomes a training row once the lookahead days after it are
+        in the window; days up to the last one trained on are skipped. Needs
+        incremental=True, as the bags then keep their training rows
+        """
+        if self.last_trained is None or not self.incremental:
+            raise ValueError('update needs a learner trained by add_evidence with incremental=True')
+        symbol_list = [symbol]
+        prices_all = get_data(symbol_list, dates = pd.date_range(sd, ed)) 
+        prices = prices_all[symbol_list]
+        
+        newY = self.createY(prices, self.lookahead, self.ybuy, self.ysell)
+        newX = self.createX(prices, symbol_list, self.lookback)[:len(newY)]
+        new = prices.index[:len(newY)] > self.last_trained
+        if np.any(new):
+            self.learner.update(newX[new], newY[new])
+            self.last_trained = prices.index[len(newY)-1]
 
 
     def testPolicy(self, symbol = "IBM", \
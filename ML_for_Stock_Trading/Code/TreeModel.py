@@ -0,0 +1,173 @@
+"""
+Tree Model
+Author: Kun Gao (GT ID: 903612738)
+Compact storage for a trained tree, as built by treeutil.build_tree
+How to use:
+    import TreeModel as tm
+    model = tm.TreeModel.from_array(tree) # from a 4-column node table
+    Y = model.query(Xtest)
+    tree = model.to_array() # back to the 4-column node table
+    forest = tm.TreeModel.concatenate([model1, model2]) # one packed model, one root per tree
+    Y_all = forest.query(Xtest) # one row of predictions per tree
+"""
+import numpy as np
+
+class TreeModel(object):
+    """
+    A tree kept as one flat array per node field:
+    feature: int16 (int32 for very wide data) index of the feature to split on, -1 in leaves
+    value: float64 or float32 split value of inner nodes, prediction of leaves
+    left, right: int32 offsets from a node to its left and right child, 0 in leaves
+    leaf_bits: bitmask with bit i set when node i is a leaf (np.packbits order)
+    roots: int32 index of the root node of each tree, [0] unless several trees are packed
+    """
+    __slots__ = ('n_nodes', 'feature', 'value', 'left', 'right', 'leaf_bits', 'roots')
+
+    def __init__(self, feature, value, left, right, leaf, roots=None):
+        leaf = np.asarray(leaf, dtype=bool)
+        self.n_nodes = len(leaf)
+        feature = np.where(leaf, -1, feature)
+        if self.n_nodes == 0 or feature.max() < np.iinfo(np.int16).max:
+            self.feature = feature.astype(np.int16)
+        else:
+            self.feature = feature.astype(np.int32)
+        value = np.asarray(value)
+        if value.dtype != np.float32:
+            value = value.astype(np.float64)
+        self.value = np.ascontiguousarray(value)
+        self.left = np.where(leaf, 0, left).astype(np.int32)
+        self.right = np.where(leaf, 0, right).astype(np.int32)
+        self.leaf_bits = np.packbits(leaf)
+        self.roots = np.zeros(1, dtype=np.int32) if roots is None else np.asarray(roots, dtype=np.int32)
+
+    def __len__(self):
+        return self.n_nodes
+
+    @property
+    def leaf(self):
+        """
+        Boolean array, True for leaf nodes
+        """
+        return np.unpackbits(self.leaf_bits, count=self.n_nodes).astype(bool)
+
+    @property
+    def nbytes(self):
+        return (self.feature.nbytes + self.value.nbytes + self.left.nbytes
+                + self.right.nbytes + self.leaf_bits.nbytes + self.roots.nbytes)
+
+    def depth(self):
+        """
+        Return: the depth of the deepest packed tree (a lone leaf has depth 0)
+        """
+        leaf = self.leaf
+        level = np.asarray(self.roots, dtype=np.intp)
+        depth = -1
+        while level.size > 0:
+            depth += 1
+            inner = level[~leaf[level]]
+            level = np.concatenate((inner + self.left[inner], inner + self.right[inner]))
+        return depth
+
+    def apply(self, points):
+        """
+        Find the leaf each test point ends up in.
+        points: a numpy array with each row corresponding to a specific query,
+            compared in the dtype of value (float32 models round the points first,
+            like their training data)
+        return: the node index of the leaf reached by each row, shaped (rows,) for
+            a single tree and (trees, rows) when several trees are packed
+        Note: every (tree, row) pair still active advances one level per
+        iteration, so the python loop runs (depth of the deepest tree) times
+        instead of (trees x rows x depth) times
+        """
+        nrec, n_feat = np.shape(points)
+        n_roots = len(self.roots)
+        # row r, feature j at r * n_feat + j, in the dtype of the split values
+        flat = np.ascontiguousarray(points, dtype=self.value.dtype).ravel()
+        leaf = self.leaf
+        node = np.repeat(self.roots.astype(np.intp), nrec)
+        base = np.tile(np.arange(nrec) * n_feat, n_roots)
+        active = np.flatnonzero(~leaf[node])
+        while active.size > 0:
+            ti = node[active]
+            go_left = flat[base[active] + self.feature[ti]] <= self.value[ti]
+            ti += np.where(go_left, self.left[ti], self.right[ti])
+            node[active] = ti
+            active = active[~leaf[ti]]
+        if n_roots == 1:
+            return node
+        return node.reshape(n_roots, nrec)
+
+    def query(self, points):
+        """
+        Estimate a set of test points given the model.
+        points: a numpy array with each row corresponding to a specific query.
+        return: the value stored in the leaf each row ends up in, shaped like apply
+        """
+        return self.value[self.apply(points)]
+
+    def to_array(self):
+        """
+        Return: the tree as the original 2-dim float array, one row per node of
+        [feature, value, left offset, right offset], leaves as [-999, value, nan, nan]
+        Note: packed trees come out one after the other, see roots for where each starts
+        """
+        leaf = self.leaf
+        tree = np.empty((self.n_nodes, 4))
+        tree[:, 0] = np.where(leaf, -999, self.feature)
+        tree[:, 1] = self.value
+        tree[:, 2] = np.where(leaf, np.nan, self.left)
+        tree[:, 3] = np.where(leaf, np.nan, self.right)
+        return tree
+
+    @classmethod
+    def from_array(cls, tree):
+        """
+        Build a TreeModel from the original 2-dim float array (see to_array)
+        """
+        leaf = tree[:, 0] < -900
+        feature = np.where(leaf, -1, tree[:, 0]).astype(np.int32)
+        left = np.where(leaf, 0, tree[:, 2]).astype(np.int32)
+        right = np.where(leaf, 0, tree[:, 3]).astype(np.int32)
+        return cls(feature, tree[:, 1], left, right, leaf)
+
+    @classmethod
+    def concatenate(cls, models):
+        """
+        Pack several trees into one TreeModel with one root per tree
+        models: list of TreeModel (themselves single trees or packed)
+        Note: child offsets are relative, so the node arrays are simply stacked
+        """
+        sizes = np.array([len(m) for m in models])
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        feature = np.concatenate([m.feature.astype(np.int32) for m in models])
+        value = np.concatenate([m.value for m in models])
+        left = np.concatenate([m.left for m in models])
+        right = np.concatenate([m.right for m in models])
+        leaf = np.concatenate([m.leaf for m in models])
+        roots = np.concatenate([m.roots + start for m, start in zip(models, starts)])
+        return cls(feature, value, left, right, leaf, roots)
+
+    def graft(self, node, subtree):
+        """
+        Replace the leaf node by a single-tree subtree, in place
+        node: index of a leaf of this model
+        subtree: TreeModel whose root takes the place of node
+        Return: start, where node k > 0 of subtree now lives at start + k - 1
+        Note: the subtree's other nodes are appended at the end, so only the
+        root's child offsets change; the node arrays are reallocated once
+        """
+        start = self.n_nodes
+        leaf = np.concatenate((self.leaf, subtree.leaf[1:]))
+        leaf[node] = subtree.leaf[0]
+        self.feature = np.concatenate((self.feature, subtree.feature[1:]))
+        self.value = np.concatenate((self.value, subtree.value[1:].astype(self.value.dtype)))
+        self.left = np.concatenate((self.left, subtree.left[1:]))
+        self.right = np.concatenate((self.right, subtree.right[1:]))
+        self.feature[node], self.value[node] = subtree.feature[0], subtree.value[0]
+        if not leaf[node]:
+            self.left[node] = start + subtree.left[0] - 1 - node
+            self.right[node] = start + subtree.right[0] - 1 - node
+        self.leaf_bits = np.packbits(leaf)
+        self.n_nodes = len(leaf)
+        return start
@@ -0,0 +1,97 @@
+"""
+Profiling
+Author: Kun Gao (GT ID: 903612738)
+Opt-in timers and counters for tree building and querying. Learners take a
+Profile as profile=...; with the default None nothing is measured.
+How to use:
+    import profiling as pf
+    profile = pf.Profile()
+    learner = dt.DTLearner(leaf_size = 5, profile = profile)
+    learner.add_evidence(Xtrain, Ytrain)
+    Y = learner.query(Xtest)
+    print(profile.report()) # or read profile.times, profile.nodes, ...
+"""
+import time
+
+
+class Profile(object):
+    """
+    times: seconds spent in each phase: 'split' (choosing the feature), 'median'
+        (split value and side of every record), 'partition' (reordering the
+        record index), 'histogram' (histogram builder), 'leaf' (leaf values),
+        'growth' (enlarging the node table) and 'query'
+    trees, nodes, leaves, max_depth: counters over all trees built
+    partition_bytes: bytes allocated by the partition step (masks and index halves)
+    bag_times: seconds spent training each bag, in bag order (BagLearner)
+    query_rows: rows scored by query
+    """
+
+    def __init__(self):
+        self.times = {}
+        self.trees = 0
+        self.nodes = 0
+        self.leaves = 0
+        self.max_depth = 0
+        self.partition_bytes = 0
+        self.bag_times = []
+        self.query_rows = 0
+
+    def lap(self, phase, since):
+        """
+        Add the time elapsed since the perf_counter reading since to phase
+        Return: the current perf_counter reading, to time the next phase from
+        """
+        now = time.perf_counter()
+        self.times[phase] = self.times.get(phase, 0.0) + now - since
+        return now
+
+    def timed(self, phase, func):
+        """
+        Return: func wrapped so the time spent in its calls is added to phase
+        """
+        def timed_func(*args):
+            since = time.perf_counter()
+            result = func(*args)
+            self.lap(phase, since)
+            return result
+        return timed_func
+
+    def add_tree(self, model):
+        """
+        Count the nodes, leaves and depth of a finished TreeModel
+        """
+        self.trees += 1
+        self.nodes += len(model)
+        self.leaves += int(model.leaf.sum())
+        self.max_depth = max(self.max_depth, model.depth())
+
+    def merge(self, other, counters=True):
+        """
+        Add the measurements of another Profile (e.g. of a bag trained in another process)
+        counters: also add its tree counters, False when its trees are pieces of
+            a tree counted on its own
+        """
+        for phase, seconds in other.times.items():
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+        if counters:
+            self.trees += other.trees
+            self.nodes += other.nodes
+            self.leaves += other.leaves
+            self.max_depth = max(self.max_depth, other.max_depth)
+        self.partition_bytes += other.partition_bytes
+        self.bag_times.extend(other.bag_times)
+        self.query_rows += other.query_rows
+
+    def report(self):
+        """
+        Return: the measurements as a few lines of text
+        """
+        lines = ['%-10s %9.4fs' % (phase, seconds) for phase, seconds in sorted(self.times.items())]
+        lines.append('trees %d, nodes %d, leaves %d, max depth %d, partition %.1f MB'
+                     % (self.trees, self.nodes, self.leaves, self.max_depth, self.partition_bytes / 1e6))
+        if self.bag_times:
+            lines.append('bags %d, %.4fs per bag (slowest %.4fs)'
+                         % (len(self.bag_times), sum(self.bag_times) / len(self.bag_times), max(self.bag_times)))
+        if self.query_rows:
+            lines.append('query %d rows' % self.query_rows)
+        return '\n'.join(lines)
@@ -5,13 +5,32 @@ How to use:
     import BagLearner as bl
     learner = bl.BagLearner(learner = al.ArbitraryLearner, kwargs = {"argument1":1, "argument2":2}, bags = 20, boost = False, verbose = False)
     learner.add_evidence(Xtrain, Ytrain)
+    learner = bl.BagLearner(dt.DTLearner, {"leaf_size": 5, "max_depth": 3}, 50, boost = True) # gradient boosting
+    learner.compile() # optional, pack all trees into one forest for faster queries
     Y = learner.query(Xtest)
+    leaves = learner.apply(Xtest) # leaf of every row in every bag, shaped (rows, bags)
+    learner.update(Xnew, Ynew) # online bagging, members built with kwargs {"incremental": True}
+    learner.save('model_dir') # write the packed forest to disk
+    learner = bl.BagLearner(rt.RTLearner, {}, 20, profile = pf.Profile()) # per-bag times and build phases, see profiling.py
+    learner = bl.BagLearner.load('model_dir') # memory-mapped, ready to query
 """
+import importlib
+import inspect
+import os
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+import TreeModel as tm
+import histtree as ht
+import profiling as pf
+
+MEMBERS = ('DTLearner', 'RTLearner') # member learner modules load() may import (only tree learners are saved)
 
 class BagLearner(object):  		   	  			  	 		  		  		    	 		 		   		 		  
   		   	  			  	 		  		  		    	 		 		   		 		  
-    def __init__(self, learner, kwargs, bags, boost=False, verbose=False):
+    def __init__(self, learner, kwargs, bags, boost=False, verbose=False, n_jobs=1, chunk_size=10000,
+                 oob=False, oob_tol=None, oob_window=5, profile=None, learning_rate=0.1):
 
         """
         Hints from project description:
@@ -21,6 +40,8 @@ class BagLearner(object):
             learners.append(learner(**kwargs))
         """
 
+        self.learner = learner
+        self.kwargs = kwargs
         self.learners = []
         for i in np.arange(bags):
             self.learners.append(learner(**kwargs))
@@ -28,29 +49,377 @@ class BagLearner(object):
         self.bags = bags 
         self.verbose = verbose
         self.boost = boost
-
-        if self.verbose and self.boost:
-            print('Note: boosting is not supported')
+        self.n_jobs = n_jobs # processes training bags / threads querying, -1 for all cores
+        self.chunk_size = chunk_size # rows scored at a time by query
+        self.forest = None # all trees packed into one TreeModel by compile()
+        self.oob = oob # score each bag on the rows its bootstrap left out
+        self.oob_tol = oob_tol # stop adding bags once the out-of-bag RMSE moves less than this
+        self.oob_window = oob_window # ... over this many bags
+        self.oob_curve = [] # out-of-bag RMSE of the first 1, 2, ... bags
+        self.profile = profile # profiling.Profile with per-bag times and the members' build phases
+        self.learning_rate = learning_rate # boost: share of each tree's prediction that is added
+        self.base = 0.0 # boost: prediction before the first tree, the mean label
         pass
 			  	 		  		  		    	 		 		   		 		  
     def author(self):  		   	  			  	 		  		  		    	 		 		   		 		  
         return 'kgao47'
 	 		  		  		    	 		 		   		 		  
     def add_evidence(self,data_x,data_y):
-        nrec = np.shape(data_x)[0]
-        for i in np.arange(self.bags):
-            index_sel = np.random.choice(nrec, nrec, replace=True) # some records repeated
-            data_x_sel = data_x[index_sel, :]
-            data_y_sel = data_y[index_sel]
+        """
+        Train every bag on its own bootstrap sample of the data
+        Note: the bootstrap samples of all bags are drawn up front as row indices
+        (see draw_bootstrap). Learners whose add_evidence takes rows train on the data
+        in place through them, others get a copy of their sample. Each bag also
+        reseeds np.random with its own seed before training, so results only
+        depend on the caller's seed, not on n_jobs. With n_jobs > 1 the data and
+        the indices are placed in shared memory once and the bags are trained in
+        a process pool.
+        Note: with oob=True (or oob_tol set) oob_curve[k] is the out-of-bag RMSE
+        of the first k+1 bags, each row being scored only by the bags whose
+        bootstrap did not draw it. With oob_tol set, training stops as soon as
+        the curve moved by at most oob_tol over the last oob_window bags and the
+        ensemble keeps only the bags trained so far.
+        Note: with boost=True the bags are boosting stages instead, see boost_stages
+        """
+        dtype = getattr(self.learners[0], 'dtype', None) if self.learners else None
+        if dtype is not None: # convert once for all bags (and the shared memory), not once per bag
+            data_x, data_y = np.asarray(data_x, dtype=dtype), np.asarray(data_y, dtype=dtype)
+        self.forest = None
+        while len(self.learners) < self.bags: # a previous fit may have stopped early
+            self.learners.append(self.learner(**self.kwargs))
+        track = self.oob or self.oob_tol is not None
+        if self.profile is not None: # each bag profiles itself, merged in collect_bags
+            for learner in self.learners:
+                if hasattr(learner, 'profile'):
+                    learner.profile = pf.Profile()
+        if self.boost:
+            self.boost_stages(data_x, data_y)
+            return
+        seeds, index = draw_bootstrap(self.bags, np.shape(data_x)[0])
+        n_jobs = n_workers(self.n_jobs)
+        if n_jobs <= 1 or self.bags <= 1:
+            state = np.random.get_state()
+            results = (train_bag(self.learners[i], data_x, data_y, index[i], seeds[i], i, self.verbose, track)
+                       for i in np.arange(self.bags)) # lazy, so stopping early skips the rest
+            self.collect_bags(results, data_y)
+            np.random.set_state(state)
+            return
+
+        blocks = []
+        try:
+            specs = []
+            for arr in (np.ascontiguousarray(data_x), np.ascontiguousarray(data_y), index):
+                shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+                blocks.append(shm)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+                specs.append((shm.name, arr.shape, arr.dtype.str))
+            with ProcessPoolExecutor(max_workers=min(n_jobs, self.bags), initializer=attach_shared,
+                                     initargs=(specs,)) as pool:
+                jobs = [pool.submit(train_shared_bag, self.learners[i], seeds[i], i, self.verbose, track)
+                        for i in np.arange(self.bags)]
+                self.collect_bags((job.result() for job in jobs), data_y)
+                for job in jobs:
+                    job.cancel()
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    def collect_bags(self, results, data_y):
+        """
+        Keep the trained bags in order, updating the out-of-bag RMSE after each one
+        results: iterable of (learner, oob_pred, seconds) as returned by train_bag
+        """
+        learners = []
+        self.oob_curve = []
+        oob_sum = np.zeros(len(data_y))
+        oob_count = np.zeros(len(data_y))
+        for learner, oob_pred, seconds in results:
+            learners.append(learner)
+            if self.profile is not None:
+                self.profile.bag_times.append(seconds)
+                if getattr(learner, 'profile', None) is not None:
+                    self.profile.merge(learner.profile)
+            if oob_pred is None:
+                continue
+            out = ~np.isnan(oob_pred)
+            oob_sum[out] += oob_pred[out]
+            oob_count[out] += 1
+            scored = oob_count > 0
+            rmse = np.sqrt(np.mean((oob_sum[scored] / oob_count[scored] - data_y[scored]) ** 2))
+            self.oob_curve.append(rmse)
             if self.verbose:
-                print('--- selecting a random portion of training dataset for bag', i)
-                print('index:', index_sel)
-                print('shape of data_x:', np.shape(data_x_sel))
-                print('shape of data_y:', np.shape(data_y_sel))
-            self.learners[i].add_evidence(data_x_sel,data_y_sel)
+                print('--- out-of-bag RMSE with', len(learners), 'bags:', rmse)
+            if self.oob_flat():
+                break
+        self.learners = learners
+
+    def boost_stages(self, data_x, data_y):
+        """
+        Gradient boosting on squared error: bag i is trained on all rows, with
+        the residuals of base plus learning_rate x the predictions of bags 0..i-1
+        as labels, and query adds up base and learning_rate x every bag's prediction
+        Note: meant for a few dozen shallow trees (members with max_depth set);
+        the stages depend on each other so they are trained one after the other,
+        n_jobs only spreads query. oob and oob_tol do not apply. Histogram
+        members share one binning of data_x instead of each binning it again.
+        """
+        self.base = float(np.mean(data_y))
+        pred = np.full(len(data_y), self.base)
+        binned = None
+        if self.learners and getattr(self.learners[0], 'histogram', False):
+            binned = (data_x,) + ht.bin_features(data_x, self.learners[0].max_bins)
+        for i, learner in enumerate(self.learners):
+            since = time.perf_counter()
+            if binned is not None:
+                learner.binned = binned
+            learner.add_evidence(data_x, data_y - pred)
+            if binned is not None:
+                learner.binned = None # do not keep data_x alive
+            pred += self.learning_rate * learner.query(data_x)
+            if self.profile is not None:
+                self.profile.bag_times.append(time.perf_counter() - since)
+                if getattr(learner, 'profile', None) is not None:
+                    self.profile.merge(learner.profile)
+            if self.verbose:
+                print('--- boosting stage', i, ': training RMSE', np.sqrt(np.mean((pred - data_y) ** 2)))
+
+    def oob_flat(self):
+        """
+        Return: True once early stopping is on and the last oob_window bags moved
+        the out-of-bag curve by at most oob_tol
+        """
+        curve = self.oob_curve
+        if self.oob_tol is None or len(curve) <= self.oob_window:
+            return False
+        return abs(curve[-1] - curve[-1 - self.oob_window]) <= self.oob_tol
+
+    def trees(self):
+        """
+        Return: the TreeModel held by each bag (None for learners that are not trees)
+        """
+        return [getattr(learner, 'tree', None) for learner in self.learners]
+
+    def update(self, new_x, new_y):
+        """
+        Add training rows to every bag without retraining (online bagging)
+        new_x, new_y: the new records, as for add_evidence
+        Note: each bag takes every new row k times with k drawn from Poisson(1),
+        the limit of how often a bootstrap sample of a large dataset repeats a
+        row, so the bags stay close to bootstraps of all the data seen so far.
+        The members need an update method (e.g. trees built with incremental=True).
+        A compiled forest is rebuilt afterwards.
+        """
+        if self.boost:
+            raise ValueError('update is not supported with boost=True')
+        index = np.arange(len(new_y))
+        for learner in self.learners:
+            index_sel = np.repeat(index, np.random.poisson(1, len(new_y)))
+            if len(index_sel) > 0:
+                learner.update(new_x[index_sel], new_y[index_sel])
+        if self.forest is not None:
+            self.compile()
+
+    def compile(self):
+        """
+        Pack the trees of all bags into a single TreeModel with one root per bag,
+        so query moves every (tree, row) pair through the forest in one pass
+        Return: True if every bag holds a tree and the forest was built
+        """
+        trees = self.trees()
+        if len(trees) == 0 or any(tree is None for tree in trees):
+            self.forest = None
+            return False
+        self.forest = tm.TreeModel.concatenate(trees)
+        return True
+
+    def save(self, path):
+        """
+        Write the packed forest and the bag parameters to the directory path
+        Note: compiles the forest first if needed, so every bag must hold a tree
+        """
+        if self.forest is None and not self.compile():
+            raise ValueError('save needs every bag to hold a TreeModel')
+        kwargs = dict(self.kwargs)
+        if 'dtype' in kwargs: # by name, to keep the header JSON
+            kwargs['dtype'] = np.dtype(kwargs['dtype']).name
+        header = {'learner': 'BagLearner', 'member': self.learner.__name__,
+                  'kwargs': kwargs, 'bags': len(self.learners),
+                  'boost': self.boost, 'learning_rate': self.learning_rate, 'base': self.base}
+        self.forest.save(path, header)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Read a bag learner written by save, its forest memory-mapped unless mmap=False
+        Note: the member learner class is imported from the module of the same
+        name, which must be one of MEMBERS; each bag gets a view of its own tree
+        inside the shared forest
+        """
+        forest, header = tm.TreeModel.load(path, mmap)
+        if header.get('member') not in MEMBERS:
+            raise ValueError('%s: unknown member learner %r, expected one of %s' % (path, header.get('member'), MEMBERS))
+        member = getattr(importlib.import_module(header['member']), header['member'])
+        learner = cls(member, header['kwargs'], header['bags'], boost=header.get('boost', False),
+                      learning_rate=header.get('learning_rate', 0.1))
+        learner.base = header.get('base', 0.0)
+        for bag, tree in zip(learner.learners, forest.split_trees()):
+            bag.tree = tree
+        learner.forest = forest
+        return learner
+
+    def apply(self, points):
+        """
+        Find the leaf each row ends up in, in every bag
+        points: a numpy array with each row corresponding to a specific query.
+        return: (rows, bags) int32 array, column i holding node indices into the
+            tree of bag i (as its learner's apply would return)
+        Note: after compile() all bags are walked at once through the packed forest
+        """
+        if self.forest is not None:
+            nodes = self.forest.apply(points).reshape(len(self.forest.roots), -1)
+            return (nodes - self.forest.roots[:, None]).T.astype(np.int32)
+        return np.column_stack([learner.apply(points) for learner in self.learners]).astype(np.int32)
 
     def query(self, points):
-        pred_all = []
-        for i in np.arange(self.bags):
-            pred_all.append(self.learners[i].query(points))
-        return np.mean(np.array(pred_all), axis=0)
+        """
+        Average the predictions of all bags (with boost=True: base plus
+        learning_rate x their sum)
+        points: a numpy array with each row corresponding to a specific query.
+        Note: rows are scored chunk_size at a time keeping only a running sum, so
+        memory grows with the chunk instead of bags x rows. With n_jobs > 1 the
+        chunks are spread over a thread pool. After compile() the packed forest is
+        used and chunk_size counts (tree, row) pairs instead of rows.
+        """
+        since = time.perf_counter()
+        nrec = np.shape(points)[0]
+        pred = np.empty(nrec)
+        step = self.chunk_size
+        if self.forest is not None: # chunk_size counts (tree, row) pairs
+            step = max(self.chunk_size // len(self.forest.roots), 1)
+
+        def score(start):
+            chunk = points[start:start + step]
+            if self.forest is not None:
+                total = np.sum(self.forest.query(chunk).reshape(len(self.forest.roots), -1), axis=0) # 1-dim for one tree
+            else:
+                total = np.zeros(np.shape(chunk)[0])
+                for learner in self.learners:
+                    total += learner.query(chunk)
+            if self.boost:
+                pred[start:start + len(total)] = self.base + self.learning_rate * total
+            else:
+                pred[start:start + len(total)] = total / len(self.learners)
+
+        self.map_chunks(score, nrec, step)
+        if self.profile is not None:
+            self.profile.lap('query', since)
+            self.profile.query_rows += nrec
+        return pred
+
+    def map_chunks(self, score, nrec, step):
+        """
+        Call score(start) for the first row of every chunk of step rows, on a
+        thread pool if n_jobs > 1
+        """
+        starts = range(0, nrec, step)
+        n_jobs = n_workers(self.n_jobs)
+        if n_jobs <= 1 or len(starts) <= 1:
+            for start in starts:
+                score(start)
+        else:
+            with ThreadPoolExecutor(max_workers=min(n_jobs, len(starts))) as pool:
+                list(pool.map(score, starts))
+
+
+def n_workers(n_jobs):
+    """
+    Return: the number of workers to use for n_jobs (-1 means one per core)
+    """
+    if n_jobs == -1:
+        return os.cpu_count() or 1
+    return max(int(n_jobs or 1), 1)
+
+
+def draw_bootstrap(bags, nrec):
+    """
+    Draw the bootstrap samples of all bags with one call to np.random
+    Return: (seeds, index), one seed per bag (reseeds np.random before the bag
+        trains, for the learner's own randomness) and a (bags, nrec) int32 array
+        with the records of each bag's sample, drawn with replacement
+    """
+    seeds = np.random.randint(0, 2**31 - 1, size=bags)
+    index = np.random.randint(0, nrec, size=(bags, nrec), dtype=np.int32)
+    return seeds, index
+
+
+def iter_bootstrap(bags, nrec):
+    """
+    Yield the bootstrap samples draw_bootstrap would return, one bag at a time
+    Note: np.random gives the same draws whether the (bags, nrec) index comes
+    from one call or from one call per bag, so only one sample is held at a time
+    """
+    np.random.randint(0, 2**31 - 1, size=bags) # the seeds, drawn first as in draw_bootstrap
+    for i in np.arange(bags):
+        yield np.random.randint(0, nrec, size=nrec, dtype=np.int32)
+
+
+def takes_rows(fit):
+    """
+    Return: True if the training method fit accepts a rows argument
+    """
+    try:
+        return 'rows' in inspect.signature(fit).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+def train_bag(learner, data_x, data_y, index_sel, seed, i=0, verbose=False, oob=False):
+    """
+    Train one bag on the bootstrap sample index_sel (records of data_x, some repeated)
+    Return: (learner, oob_pred, seconds), the trained learner, if oob its predictions
+        for the rows left out of the sample (nan for rows in the sample), and the
+        time taken by training
+    Note: learners taking rows train on data_x in place, others on a copy of the sample
+    """
+    since = time.perf_counter()
+    np.random.seed(seed)
+    nrec = np.shape(data_x)[0]
+    if verbose:
+        print('--- bag', i, ': training on', len(index_sel), 'records drawn with replacement,',
+              len(np.unique(index_sel)), 'distinct')
+    if takes_rows(learner.add_evidence):
+        learner.add_evidence(data_x, data_y, rows=index_sel)
+    else:
+        learner.add_evidence(data_x[index_sel], data_y[index_sel])
+    seconds = time.perf_counter() - since
+    if not oob:
+        return learner, None, seconds
+    out = np.ones(nrec, dtype=bool)
+    out[index_sel] = False
+    oob_pred = np.full(nrec, np.nan)
+    if np.any(out):
+        oob_pred[out] = learner.query(data_x[out])
+    return learner, oob_pred, seconds
+
+
+_shared = [] # (SharedMemory, array) pairs attached by a pool worker
+
+
+def attach_shared(specs):
+    """
+    Pool initializer: map the training arrays published by the parent process
+    specs: list of (shared memory name, shape, dtype) for data_x, data_y and the bootstrap index
+    """
+    del _shared[:]
+    for name, shape, dtype in specs:
+        shm = shared_memory.SharedMemory(name=name)
+        _shared.append((shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)))
+
+
+def train_shared_bag(learner, seed, i=0, verbose=False, oob=False):
+    """
+    Pool task: train one bag on the arrays mapped by attach_shared
+    """
+    data_x, data_y, index = [arr for shm, arr in _shared]
+    return train_bag(learner, data_x, data_y, index[i], seed, i, verbose, oob)
@@ -1,19 +1,15 @@
+import itertools
 import numpy as np
-import LinRegLearner as lrl
 import BagLearner as bl
+import bootlinreg as blr
 class InsaneLearner(object):
     def __init__(self, verbose=False):
         self.verbose = verbose
-        self.learners = []
-        for i in np.arange(20):
-            self.learners.append(bl.BagLearner(learner=lrl.LinRegLearner, kwargs={}, bags=20, boost=False, verbose=False))
+        self.coefs = None # 20 bags of 20 bootstrap linear regressions, solved from weighted Gram matrices and averaged
     def author(self):
         return 'kgao47'
     def add_evidence(self,data_x,data_y):
-        for i in np.arange(20):
-            self.learners[i].add_evidence(data_x,data_y)
+        samples = itertools.chain(*[bl.iter_bootstrap(20, data_x.shape[0]) for i in np.arange(20)]) # as 20 BagLearners would draw
+        self.coefs = np.mean(blr.fit_bootstrap(data_x, data_y, samples), axis=0)
     def query(self, points):
-        pred_all = []
-        for i in np.arange(20):
-            pred_all.append(self.learners[i].query(points))
-        return np.mean(np.array(pred_all), axis=0)
\ No newline at end of file
+        return blr.predict(self.coefs, points)
\ No newline at end of file
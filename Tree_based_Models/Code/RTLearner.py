@@ -6,15 +6,49 @@ How to use:
     learner = rt.RTLearner(leaf_size = 1, verbose = False) # constructor
     learner.add_evidence(Xtrain, Ytrain) # training step
     Y = learner.query(Xtest) # query
+    leaves = learner.apply(Xtest) # leaf node index of every row
+    Y_grid = learner.query_leaf_sizes(Xtest, [1, 5, 10]) # needs grow_full = True, one row per leaf_size
+    learner.update(Xnew, Ynew) # add rows without retraining, needs incremental = True
+    learner.add_evidence_csv('big.csv', chunk_rows = 100000) # out of core, label in the last column
+    learner.save('model_dir') # write the trained tree to disk
+    learner = rt.RTLearner(leaf_size = 1, profile = pf.Profile()) # per-phase timings in learner.profile, see profiling.py
+    learner = rt.RTLearner(leaf_size = 1, dtype = np.float32) # train and query in float32
+    learner = rt.RTLearner(leaf_size = 1, split = 'random') # extra-trees split values, faster to train
+    learner = rt.RTLearner.load('model_dir') # memory-mapped, ready to query
 """
 
+import time
 import numpy as np
+import treeutil as tu
+import TreeModel as tm
+import histtree as ht
+import datasets as ds
   		   	  			  	 		  		  		    	 		 		   		 		  
 class RTLearner(object):
   		   	  			  	 		  		  		    	 		 		   		 		  
-    def __init__(self, leaf_size=1, verbose=False):
+    def __init__(self, leaf_size=1, verbose=False, histogram=False, max_bins=256, incremental=False, split_factor=2,
+                 keep_leaves=False, grow_full=False, profile=None, dtype=np.float64, max_depth=None,
+                 split='median'):
         self.leaf_size = leaf_size	
         self.verbose = verbose
+        self.histogram = histogram # split on features pre-binned into uint8 bins
+        self.max_bins = max_bins
+        self.incremental = incremental # keep the training rows so update() can add more
+        self.split_factor = split_factor # update() regrows leaves past leaf_size x split_factor rows
+        self.updater = None
+        self.keep_leaves = keep_leaves # remember the leaf of every training row, see apply
+        self.train_leaves = None
+        self.grow_full = grow_full # grow down to single records once, then prune to any leaf_size
+        self.full_tree, self.node_count, self.node_total = None, None, None
+        self.profile = profile # profiling.Profile collecting build and query timings, None for off
+        self.dtype = np.dtype(dtype) # float32 halves the data copies and the tree, see add_evidence
+        self.max_depth = max_depth # nodes this deep become leaves (e.g. shallow trees for boosting)
+        self.binned = None # (data_x, bins, edges) for build_tree_hist to reuse, see BagLearner.boost_stages
+        if split not in ('median', 'random'):
+            raise ValueError("split must be 'median' or 'random', not %r" % (split,))
+        if split == 'random' and histogram:
+            raise ValueError("split='random' needs the exact splits, not histogram=True")
+        self.split = split # 'random': split at the mean of two random records' values instead of the median
         if self.verbose:
             print('You are using the Random Tree Learner')
             print('The leaf size is', self.leaf_size)
@@ -30,42 +64,170 @@ class RTLearner(object):
         _, total_idx = np.shape(x)
         return np.random.randint(0,total_idx)
 
-    def add_evidence(self, data_x, data_y):
+    def add_evidence(self, data_x, data_y, rows=None):
         """
         Add training data to learner
         data_x: A set of feature values used to train the learner
         data_y: The value we are attempting to predict given the X data
+        rows: indices of the records to train on (repeats allowed, e.g. a bootstrap
+            sample), None for all; the tree reads them in place instead of copying
+        Note: the data is converted to dtype first (no copy if it already is), so
+        with float32 the medians, the node table and the tree are float32 too
+        and query compares in float32
         """
-        self.tree = self.build_tree(data_x, data_y)
+        data_x, data_y = np.asarray(data_x, dtype=self.dtype), np.asarray(data_y, dtype=self.dtype)
+        build = self.build_tree_hist if self.histogram else self.build_tree
+        self.full_tree, self.node_count, self.node_total = None, None, None
+        if self.grow_full:
+            self.full_tree, self.node_count, self.node_total = build(data_x, data_y, rows=rows, leaf_size=1,
+                                                                     return_stats=True)
+            self.tree = self.prune(self.leaf_size)
+            leaves = None
+            if self.keep_leaves:
+                leaves = self.tree.apply(data_x if rows is None else data_x[rows])
+        else:
+            self.tree, leaves = build(data_x, data_y, return_leaves=True, rows=rows)
+        self.train_leaves = leaves if self.keep_leaves else None
+        self.updater = None
+        if self.incremental:
+            if rows is not None: # the updater keeps its own copy of the rows anyway
+                data_x, data_y = data_x[rows], data_y[rows]
+            self.updater = tu.TreeUpdater(self.tree, data_x, data_y, self.leaf_size, self.split_factor, leaves)
 
-    def build_tree(self, data_x, data_y):
+    def prune(self, leaf_size):
+        """
+        Return: the TreeModel a build with leaf_size would give, cut from the
+            fully grown tree instead of retrained (needs grow_full=True)
+        """
+        if self.full_tree is None:
+            raise ValueError('prune needs grow_full=True and no update since add_evidence')
+        return tu.prune(self.full_tree, self.node_count, self.node_total, leaf_size)
+
+    def query_leaf_sizes(self, points, grid):
+        """
+        Estimate a set of test points with the tree of every leaf_size in grid
+        points: a numpy array with each row corresponding to a specific query.
+        Return: (len(grid), rows) array, one row of predictions per leaf_size,
+            from a single walk through the fully grown tree (needs grow_full=True)
+        """
+        if self.full_tree is None:
+            raise ValueError('query_leaf_sizes needs grow_full=True and no update since add_evidence')
+        return tu.query_leaf_sizes(self.full_tree, self.node_count, self.node_total, points, grid)
+
+    def update(self, new_x, new_y):
+        """
+        Add training rows to the trained tree without rebuilding it
+        new_x, new_y: the new records, as for add_evidence
+        Note: the new rows only touch the leaves they reach; a leaf that grows
+        past leaf_size x split_factor rows is replaced by a subtree grown from
+        its rows (with the exact splits, also when histogram=True; not limited by max_depth).
+        The fully grown tree of grow_full no longer matches the updated tree and
+        is dropped, prune and query_leaf_sizes need a new add_evidence
+        """
+        if self.updater is None:
+            raise ValueError('update needs a tree trained by add_evidence with incremental=True')
+        self.updater.update(np.asarray(new_x, dtype=self.dtype), np.asarray(new_y, dtype=self.dtype),
+                            self.feature_finder, split_value=self.split_value())
+        self.full_tree, self.node_count, self.node_total = None, None, None
+
+    def build_tree(self, data_x, data_y, return_leaves=False, rows=None, leaf_size=None, return_stats=False):
         """
         Build a decision tree based on the algorithm in Balch slides
-        Return: a 2-dim array describing the tree
-        Note: the number -999 is used to represent a 'leaf' node
+        leaf_size: overrides self.leaf_size
+        Return: a TreeModel describing the tree (to_array() gives the old 2-dim array),
+            with return_leaves the leaf of every training row and with return_stats
+            the node counts and label sums (see tu.build_tree)
+        """
+        leaf_size = self.leaf_size if leaf_size is None else leaf_size
+        return tu.build_tree(data_x, data_y, leaf_size, self.feature_finder(data_x),
+                             return_leaves=return_leaves, rows=rows, return_stats=return_stats, profile=self.profile,
+                             max_depth=self.max_depth, split_value=self.split_value())
+
+    def split_value(self):
+        """
+        Return: the split_value callable tu.build_tree uses, the median or, with
+            split='random', the mean of two randomly drawn records (O(1) per node)
+        """
+        return tu.random_split_value if self.split == 'random' else np.median
+
+    def feature_finder(self, data_x):
+        """
+        Return: the find_feature callable tu.build_tree uses on data_x
         """
-        if data_x.shape[0] <= self.leaf_size: # if all data can fit in the same leaf
-            return np.array([[-999, np.mean(data_y), np.nan, np.nan]])
-        elif np.max(data_y) == np.min(data_y): # if all labels are the same
-            return np.array([[-999, data_y[0], np.nan, np.nan]])
+        # find a random feature i to split on at each node
+        return lambda rows, ys: self.find_feature_idx(data_x)
+
+    def build_tree_hist(self, data_x, data_y, return_leaves=False, rows=None, leaf_size=None, return_stats=False):
+        """
+        Build the tree from features quantized once into at most max_bins bins
+        Return: a TreeModel describing the tree, with real-valued split values,
+            and with return_leaves the leaf of every training row
+        Note: with rows the bin edges still come from all of data_x
+        """
+        leaf_size = self.leaf_size if leaf_size is None else leaf_size
+        if self.binned is not None and self.binned[0] is data_x:
+            bins, edges = self.binned[1:]
         else:
-            # find a random feature i to split on
-            idx = self.find_feature_idx(data_x)
-            SplitVal = np.median(data_x[:,idx])
-
-            data_x_left = data_x[data_x[:,idx] <= SplitVal]
-            data_y_left = data_y[data_x[:,idx] <= SplitVal]
-            data_x_right = data_x[data_x[:,idx] > SplitVal]
-            data_y_right = data_y[data_x[:,idx] > SplitVal]
-
-            if len(data_y_right) == 0: # all data on the same side
-                return np.array([[-999, np.mean(data_y_left), np.nan, np.nan]])
-            else: # ok, needs recursion
-                left = self.build_tree(data_x_left, data_y_left)
-                right= self.build_tree(data_x_right,data_y_right)
-                root = np.array([[idx, SplitVal, 1, np.shape(left)[0]+1]])
-                combined = np.vstack((root, left, right))
-                return combined
+            bins, edges = ht.bin_features(data_x, self.max_bins)
+        # find a random feature i to split on at each node
+        find_feature = lambda count, ysum, ys: self.find_feature_idx(data_x)
+        return ht.build_tree_hist(bins, edges, data_y, leaf_size, find_feature, return_leaves, rows, return_stats,
+                                  self.profile, self.max_depth)
+
+    def add_evidence_csv(self, path, chunk_rows=100000, max_nodes=1024):
+        """
+        Train on a CSV file too large for memory, reading it chunk_rows records at a time
+        path: CSV file with the label in the last column (header and date columns are skipped)
+        max_nodes: tree nodes whose histograms are gathered in the same pass
+        Note: one pass sketches the bin edges, then every tree level takes a pass;
+        the splits are at median bins, so split='random' is not supported
+        """
+        if self.split == 'random':
+            raise ValueError("add_evidence_csv splits at median bins, it does not support split='random'")
+        cast = lambda c: c.astype(self.dtype, copy=False)
+        chunks = lambda: ((c[:, :-1], c[:, -1]) for c in map(cast, ds.iter_csv(path, chunk_rows)))
+        edges = ht.sketch_edges(chunks, self.max_bins).astype(self.dtype)
+        # find a random feature i to split on at each node
+        find_feature = lambda count, ysum, yss: np.random.randint(0, np.shape(edges)[0])
+        self.tree = ht.build_tree_stream(chunks, edges, self.leaf_size, find_feature, max_nodes, self.max_depth)
+        self.full_tree, self.node_count, self.node_total = None, None, None
+        self.updater = None
+        self.train_leaves = None
+
+    def save(self, path):
+        """
+        Write the trained tree and the learner parameters to the directory path
+        """
+        kwargs = {'leaf_size': self.leaf_size, 'histogram': self.histogram, 'max_bins': self.max_bins,
+                  'dtype': self.dtype.name, 'max_depth': self.max_depth, 'split': self.split}
+        self.tree.save(path, {'learner': 'RTLearner', 'kwargs': kwargs})
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Read a learner written by save, its tree memory-mapped unless mmap=False
+        """
+        tree, header = tm.TreeModel.load(path, mmap)
+        learner = cls(**header['kwargs'])
+        learner.tree = tree
+        return learner
+
+    def apply(self, points=None):
+        """
+        Find the leaf each row ends up in, with the same batched traversal as query
+        points: a numpy array with each row corresponding to a specific query, or
+            None for the training rows (kept at training time with keep_leaves=True,
+            or tracked through update() with incremental=True; no traversal)
+        return: int32 array with the node index of the leaf of every row, so
+            self.tree.value[leaves] are the predictions
+        """
+        if points is not None:
+            return self.tree.apply(points).astype(np.int32)
+        if self.updater is not None:
+            return self.updater.leaves()
+        if self.train_leaves is None:
+            raise ValueError('apply() without points needs keep_leaves=True or incremental=True')
+        return self.train_leaves
 
     def query(self, points):
         """
@@ -73,20 +235,13 @@ class RTLearner(object):
         points: a numpy array with each row corresponding to a specific query.
         return: the predicted result of the input data according to the trained model
         """
-        nrec,_ = np.shape(points)
-        pred_all = np.zeros(nrec) # output
-
-        for i in np.arange(nrec):
-            one_entry = points[i,:]
-            ti = 0
-            while self.tree[ti][0] > -900: # if not a leaf
-                if one_entry[np.int(self.tree[ti][0])] <= self.tree[ti][1]:
-                    ti += np.int(self.tree[ti][2]) # left
-                else:
-                    ti += np.int(self.tree[ti][3]) # right
-            pred_all[i] = self.tree[ti][1]
-
-        return pred_all
+        if self.profile is None:
+            return self.tree.query(points)
+        since = time.perf_counter()
+        result = self.tree.query(points)
+        self.profile.lap('query', since)
+        self.profile.query_rows += len(points)
+        return result
 
 if __name__ == "__main__":
     print("the secret clue is 'zzyzx'")
\ No newline at end of file
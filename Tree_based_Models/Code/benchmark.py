@@ -0,0 +1,260 @@
+"""
+Benchmark
+Author: Kun Gao (GT ID: 903612738)
+Times the tree learners on every CSV in Tree_based_Models/Data and on synthetic
+data of growing size, and writes the results to a JSON file so two commits can
+be compared.
+How to use:
+    python benchmark.py --out before.json # full sweep
+    python benchmark.py --quick --out after.json --compare before.json # flags regressions
+Every case runs in its own python process, so peak RSS is the case's own. A
+case that needs a module that is not installed is skipped; any other error is
+reported as FAILED and makes the exit status 1.
+Metrics per case: train_time (s), query_rate (rows/s), latency_us (median time
+to query a single row), peak_rss_mb, nodes, depth, model_bytes and rmse on a
+held-out 40% of the rows. The 'Boosting' cases (BagLearner with boost=True over
+DTLearner trees of max_depth 3) sit next to the bagged ones, so accuracy can be
+weighed against latency and model size, and the 'RTLearner-random' cases time
+RTLearner with split='random' against the median splits.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+METRICS = ('train_time', 'query_rate', 'latency_us', 'peak_rss_mb') # compared by --compare
+KEY = ('learner', 'dataset', 'leaf_size', 'bags')
+RSS_UNIT = 1.0 if sys.platform == 'darwin' else 1024.0 # ru_maxrss is in bytes on macOS, kilobytes on Linux
+
+
+def author():
+    return 'kgao47'
+
+
+def synthetic(rows, features, seed=0):
+    """
+    Return: (rows, features + 1) array, a smooth nonlinear label plus noise in the last column
+    """
+    rng = np.random.RandomState(seed)
+    x = rng.randn(rows, features)
+    y = 2 * x[:, 0] + np.sin(3 * x[:, 1 % features]) + 0.5 * x[:, -1] ** 2 + 0.1 * rng.randn(rows)
+    return np.column_stack((x, y))
+
+
+def load_dataset(name):
+    """
+    name: a CSV file name in Tree_based_Models/Data (read through its binary
+        cache, see datasets.load_cached), or 'synthetic-<rows>x<features>'
+    """
+    if name.startswith('synthetic-'):
+        rows, features = name[len('synthetic-'):].split('x')
+        return synthetic(int(rows), int(features))
+    import datasets as ds
+    return np.column_stack(ds.load_cached(os.path.join(DATA_DIR, name)))
+
+
+def make_learner(case):
+    if case['learner'] == 'DTLearner':
+        import DTLearner as dt
+        return dt.DTLearner(leaf_size=case['leaf_size'])
+    if case['learner'] == 'RTLearner':
+        import RTLearner as rt
+        return rt.RTLearner(leaf_size=case['leaf_size'])
+    if case['learner'] == 'RTLearner-random':
+        import RTLearner as rt
+        return rt.RTLearner(leaf_size=case['leaf_size'], split='random')
+    if case['learner'] == 'BagLearner':
+        import BagLearner as bl
+        import RTLearner as rt
+        return bl.BagLearner(rt.RTLearner, {'leaf_size': case['leaf_size']}, case['bags'])
+    if case['learner'] == 'Boosting':
+        import BagLearner as bl
+        import DTLearner as dt
+        return bl.BagLearner(dt.DTLearner, {'leaf_size': case['leaf_size'], 'max_depth': 3}, case['bags'],
+                             boost=True)
+    if case['learner'] == 'InsaneLearner':
+        import InsaneLearner as it
+        return it.InsaneLearner()
+    raise ValueError('unknown learner %s' % case['learner'])
+
+
+def run_case(case):
+    """
+    Train and query one learner on one dataset in this process
+    Return: dict of metrics
+    """
+    data = load_dataset(case['dataset'])
+    np.random.seed(0)
+    order = np.random.permutation(data.shape[0])
+    n_train = int(0.6 * data.shape[0])
+    train, test = data[order[:n_train]], data[order[n_train:]]
+
+    learner = make_learner(case)
+    start = time.perf_counter()
+    learner.add_evidence(train[:, :-1], train[:, -1])
+    if hasattr(learner, 'compile'):
+        learner.compile()
+    train_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pred = learner.query(data[:, :-1])
+    query_time = time.perf_counter() - start
+    latency = []
+    for i in np.arange(50):
+        start = time.perf_counter()
+        learner.query(data[i % data.shape[0]:i % data.shape[0] + 1, :-1])
+        latency.append(time.perf_counter() - start)
+
+    model = getattr(learner, 'forest', None)
+    if model is None:
+        model = getattr(learner, 'tree', None)
+    result = {
+        'train_time': train_time,
+        'query_rate': data.shape[0] / max(query_time, 1e-9),
+        'latency_us': float(np.median(latency)) * 1e6,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 2**20,
+        'rmse': float(np.sqrt(np.mean((pred[order[n_train:]] - test[:, -1]) ** 2))),
+        'nodes': None, 'depth': None, 'model_bytes': None,
+    }
+    if model is not None and hasattr(model, 'roots'):
+        result.update({'nodes': len(model), 'depth': model.depth(), 'model_bytes': model.nbytes})
+    return result
+
+
+def measure(case, repeat=1):
+    """
+    Run a case repeat times, each in a fresh python process
+    Return: the case with the metrics of its fastest run, with 'skipped' set if
+        the case needs a module that is not installed, or with 'failed' set to
+        the error if it raised anything else
+    """
+    best = None
+    for i in np.arange(repeat):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case', json.dumps(case)],
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode != 0:
+            lines = proc.stderr.strip().splitlines()
+            return dict(case, failed=lines[-1] if lines else 'exit status %d' % proc.returncode)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        if 'skipped' in result:
+            return dict(case, **result)
+        if best is None or result['train_time'] < best['train_time']:
+            best = result
+    return dict(case, **best)
+
+
+def sweep(quick=False):
+    """
+    Return: the list of cases to run, each a dict with the KEY fields
+    """
+    files = sorted(os.path.basename(f) for f in glob.glob(os.path.join(DATA_DIR, '*.csv')))
+    if quick:
+        sizes, widths, leaf_sizes, bag_counts = (1000, 10000), (4,), (1, 5), (10,)
+        boost_counts = (30,)
+    else:
+        sizes, widths, leaf_sizes, bag_counts = (1000, 10000, 100000), (4, 16), (1, 5, 20), (1, 10, 20)
+        boost_counts = (10, 30, 100)
+    datasets = files + ['synthetic-%dx%d' % (n, f) for n in sizes for f in widths]
+    cases = []
+    for dataset in datasets:
+        for leaf_size in leaf_sizes:
+            cases.append({'learner': 'DTLearner', 'dataset': dataset, 'leaf_size': leaf_size, 'bags': None})
+            cases.append({'learner': 'RTLearner', 'dataset': dataset, 'leaf_size': leaf_size, 'bags': None})
+            cases.append({'learner': 'RTLearner-random', 'dataset': dataset, 'leaf_size': leaf_size, 'bags': None})
+        for bags in bag_counts:
+            cases.append({'learner': 'BagLearner', 'dataset': dataset, 'leaf_size': 5, 'bags': bags})
+        for bags in boost_counts:
+            cases.append({'learner': 'Boosting', 'dataset': dataset, 'leaf_size': 5, 'bags': bags})
+        cases.append({'learner': 'InsaneLearner', 'dataset': dataset, 'leaf_size': None, 'bags': None})
+    return cases
+
+
+def compare(old, new, tolerance=0.2):
+    """
+    Match the cases of two result files and list the metrics that got worse by
+    more than tolerance (a fraction); time and memory regress upwards, rates downwards
+    Return: list of (case key, metric, old value, new value)
+    """
+    before = {tuple(r.get(k) for k in KEY): r for r in old['results'] if 'skipped' not in r and 'failed' not in r}
+    regressions = []
+    for r in new['results']:
+        key = tuple(r.get(k) for k in KEY)
+        if 'skipped' in r or 'failed' in r or key not in before:
+            continue
+        for metric in METRICS:
+            if metric not in before[key] or metric not in r: # e.g. an older result file
+                continue
+            a, b = before[key][metric], r[metric]
+            worse = b < a * (1 - tolerance) if metric == 'query_rate' else b > a * (1 + tolerance)
+            if worse:
+                regressions.append((key, metric, a, b))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the tree learners')
+    parser.add_argument('--out', default='benchmark.json', help='JSON file to write the results to')
+    parser.add_argument('--quick', action='store_true', help='smaller sweep')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case, the fastest is kept')
+    parser.add_argument('--learner', action='append', help='only run these learners')
+    parser.add_argument('--compare', help='earlier result file to flag regressions against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown before flagging')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        try:
+            result = run_case(json.loads(args.run_case))
+        except ModuleNotFoundError as err: # an optional learner module that is not installed; anything else fails the case
+            result = {'skipped': '%s: %s' % (type(err).__name__, err)}
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for case in sweep(args.quick):
+        if args.learner and case['learner'] not in args.learner:
+            continue
+        result = measure(case, args.repeat)
+        results.append(result)
+        if 'failed' in result:
+            print('%-16s %-28s FAILED: %s' % (case['learner'], case['dataset'], result['failed']))
+        elif 'skipped' in result:
+            print('%-16s %-28s skipped: %s' % (case['learner'], case['dataset'], result['skipped']))
+        else:
+            print('%-16s %-28s leaf=%-4s bags=%-4s train %.3fs  query %.0f rows/s  latency %.0fus  '
+                  'model %sB  rss %.0fMB  rmse %.4f'
+                  % (case['learner'], case['dataset'], case['leaf_size'], case['bags'], result['train_time'],
+                     result['query_rate'], result['latency_us'], result['model_bytes'], result['peak_rss_mb'],
+                     result['rmse']))
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'numpy': np.__version__,
+              'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        for key, metric, a, b in regressions:
+            print('REGRESSION %s %s: %.4g -> %.4g' % (' '.join(str(k) for k in key), metric, a, b))
+        if regressions:
+            return 1
+    return 1 if any('failed' in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Bootstrap Linear Regression
+Author: Kun Gao (GT ID: 903612738)
+Fits many bootstrapped least-squares models from count-weighted Gram matrices,
+instead of solving each one on a materialized bootstrap copy of X.
+How to use:
+    import bootlinreg as blr
+    import BagLearner as bl
+    coefs = blr.fit_bootstrap(Xtrain, Ytrain, bl.iter_bootstrap(20, Xtrain.shape[0])) # one row of coefficients per fit
+    Y = blr.predict(coefs.mean(axis=0), Xtest) # average model of the ensemble
+"""
+import numpy as np
+
+
+def fit_bootstrap(data_x, data_y, samples, block=20, chunk_rows=4096):
+    """
+    Solve the least-squares problem of every bootstrap sample
+    data_x: A set of feature values used to train the learner
+    data_y: The value we are attempting to predict given the X data
+    samples: iterable of the records drawn by each bootstrap sample, one array
+        per fit, e.g. BagLearner.iter_bootstrap drawing them on demand
+    block: samples whose draw counts are held (as uint16) and accumulated together
+    chunk_rows: rows whose outer products are formed at a time
+    Return: (fits, features + 1) coefficients, intercept last (as LinRegLearner)
+    Note: fit k solves (X'WX) w = X'Wy with W = diag(draw counts of sample k)
+    and X padded with a column of ones. Each sample is counted with np.bincount
+    as it is drawn; every block of counts then meets the upper triangle of the
+    rows' outer products (and x * y) in one matrix product per row chunk, so
+    memory stays near one copy of X whatever the number of fits. Singular
+    systems fall back to the pseudo-inverse, which gives the same
+    minimum-norm answer as np.linalg.lstsq.
+    """
+    nrec, n_feat = np.shape(data_x)
+    dim = n_feat + 1
+    x = np.ones((nrec, dim))
+    x[:, :n_feat] = data_x
+    upper = np.triu_indices(dim)
+    n_upper = len(upper[0])
+    counts = np.empty((block, nrec), dtype=np.uint16)
+    sums = []
+
+    def accumulate(k):
+        total = np.zeros((k, n_upper + dim))
+        for lo in np.arange(0, nrec, chunk_rows):
+            xc = x[lo:lo + chunk_rows]
+            terms = np.concatenate((xc[:, upper[0]] * xc[:, upper[1]], xc * data_y[lo:lo + chunk_rows, None]), axis=1)
+            total += np.dot(counts[:k, lo:lo + chunk_rows].astype(np.float64), terms)
+        sums.append(total)
+
+    k = 0
+    for index_sel in samples:
+        counts[k] = np.bincount(index_sel, minlength=nrec)
+        k += 1
+        if k == block:
+            accumulate(k)
+            k = 0
+    if k > 0:
+        accumulate(k)
+    sums = np.concatenate(sums)
+    gram = np.zeros((len(sums), dim, dim))
+    gram[:, upper[0], upper[1]] = sums[:, :n_upper]
+    gram[:, upper[1], upper[0]] = sums[:, :n_upper]
+    rhs = sums[:, n_upper:]
+    try:
+        return np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        return np.matmul(np.linalg.pinv(gram), rhs[:, :, None])[:, :, 0]
+
+
+def predict(coefs, points):
+    """
+    Evaluate one linear model (intercept last) on a set of test points
+    """
+    return np.dot(points, coefs[:-1]) + coefs[-1]
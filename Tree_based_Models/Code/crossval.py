@@ -0,0 +1,343 @@
+"""
+Cross Validation
+Author: Kun Gao (GT ID: 903612738)
+k-fold cross validation and learning curves of a learner over a grid of
+kwargs, on the CSV files in Tree_based_Models/Data.
+How to use:
+    python crossval.py --learner DTLearner --grid '{"leaf_size": [1, 5, 20]}' --folds 5
+    python crossval.py --learner RTLearner --grid '{"leaf_size": [5]}' --curve 0.1 0.25 0.5 1
+    python crossval.py --learner BagLearner --member RTLearner --grid '{"bags": [10, 20], "leaf_size": [5]}'
+    python crossval.py --learner InsaneLearner --grid '{}' # takes no kwargs
+    import crossval as cv
+    rows = cv.cross_validate(dt.DTLearner, {"leaf_size": [1, 5, 20]}, k = 5) # one dict per (dataset, config, fold)
+    print(cv.report(cv.summarize(rows)))
+Learners are built as learner(**config). With member, learner wraps it as
+BagLearner does: the config entries learner's __init__ names (bags, boost, ...)
+go to learner and the rest to every member. Configs that do not fit are
+rejected before any work starts.
+Every dataset is read through its binary cache (datasets.load_cached, so a CSV
+is only parsed the first time) and placed in shared memory for the worker
+processes. Each (dataset hash, fold, config) result is cached as a small JSON
+file in cache_dir, so an interrupted or extended sweep only computes what is
+missing. The dataset hash covers the parsed values, so an edited CSV gets new
+entries.
+"""
+import argparse
+import glob
+import hashlib
+import importlib
+import inspect
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import datasets as ds
+import BagLearner as bl
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cv_cache')
+BAGS = 20 # bags of a wrapper learner whose grid does not set them
+
+
+def author():
+    return 'kgao47'
+
+
+def config_grid(grid):
+    """
+    grid: dict mapping each kwarg to the list of values to try
+    Return: list of kwargs dicts, one per combination
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def split_kwargs(learner, kwargs):
+    """
+    Return: (wrapper kwargs, member kwargs), the entries of kwargs learner's
+        __init__ names and the others; bags defaults to BAGS
+    """
+    params = inspect.signature(learner).parameters
+    own = {name: value for name, value in kwargs.items() if name in params}
+    own.setdefault('bags', BAGS)
+    return own, {name: value for name, value in kwargs.items() if name not in params}
+
+
+def build_learner(learner, kwargs, member=None):
+    """
+    Return: learner(**kwargs), or with member a learner(member, member kwargs,
+        **wrapper kwargs) as split by split_kwargs
+    """
+    if member is None:
+        return learner(**kwargs)
+    own, rest = split_kwargs(learner, kwargs)
+    return learner(member, rest, **own)
+
+
+def check_configs(learner, grid, member=None):
+    """
+    Raise ValueError if a config of grid does not fit the __init__ of learner
+    (or of learner and member), e.g. BagLearner without member
+    """
+    for kwargs in config_grid(grid):
+        try:
+            if member is None:
+                inspect.signature(learner).bind(**kwargs)
+            else:
+                own, rest = split_kwargs(learner, kwargs)
+                inspect.signature(learner).bind(member, rest, **own)
+                inspect.signature(member).bind(**rest)
+        except TypeError as e:
+            wrapper = member is None and 'learner' in inspect.signature(learner).parameters
+            raise ValueError('cannot build %s%s from %s: %s%s'
+                             % (learner.__name__, '' if member is None else ' of ' + member.__name__,
+                                json.dumps(kwargs, default=str), e,
+                                ' (%s wraps a member learner, pass member)' % learner.__name__ if wrapper else ''))
+
+
+def dataset_hash(data):
+    """
+    Return: hex digest of the shape and values of a parsed dataset
+    """
+    digest = hashlib.sha1(str(np.shape(data)).encode())
+    digest.update(np.ascontiguousarray(data).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def task_key(learner, kwargs, data_hash, fold, k, fraction, seed, member=None):
+    """
+    Return: the cache file name of one result, a digest of everything it depends on
+    """
+    spec = {'learner': '%s.%s' % (learner.__module__, learner.__name__), 'kwargs': kwargs, 'data': data_hash,
+            'fold': fold, 'k': k, 'fraction': fraction, 'seed': seed}
+    if member is not None:
+        spec['member'] = '%s.%s' % (member.__module__, member.__name__)
+    return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest() + '.json'
+
+
+def folds(nrec, k, seed=0):
+    """
+    Return: list of k arrays with the test rows of each fold, from one seeded shuffle
+    """
+    return np.array_split(np.random.RandomState(seed).permutation(nrec), k)
+
+
+def fit_fold(learner, kwargs, data, fold, k, fraction=1.0, seed=0, member=None):
+    """
+    Train on the rows outside fold (the first fraction of them, in shuffled
+    order) and score on the rows of fold
+    learner, kwargs, member: the model, see build_learner
+    Return: dict of n_train, train_time, train_rmse, rmse and corr
+    """
+    split = folds(len(data), k, seed)
+    test = split[fold]
+    train = np.concatenate(split[:fold] + split[fold + 1:])
+    train = train[:max(int(round(fraction * len(train))), 1)]
+    np.random.seed(seed + fold)
+    model = build_learner(learner, kwargs, member)
+    start = time.perf_counter()
+    model.add_evidence(data[train, :-1], data[train, -1])
+    train_time = time.perf_counter() - start
+    fit = model.query(data[train, :-1])
+    pred = model.query(data[test, :-1])
+    corr = np.corrcoef(pred, data[test, -1])[0, 1] if np.std(pred) > 0 else 0.0
+    return {'n_train': int(len(train)), 'train_time': train_time,
+            'train_rmse': float(np.sqrt(np.mean((fit - data[train, -1]) ** 2))),
+            'rmse': float(np.sqrt(np.mean((pred - data[test, -1]) ** 2))), 'corr': float(corr)}
+
+
+_shared = {} # dataset name -> (SharedMemory, array), attached by a pool worker
+
+
+def attach_shared(specs):
+    """
+    Pool initializer: map the datasets published by the parent process
+    specs: dict of dataset name -> (shared memory name, shape, dtype)
+    """
+    _shared.clear()
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def fit_shared_fold(learner, kwargs, name, fold, k, fraction, seed, member):
+    """
+    Pool task: fit_fold on a dataset mapped by attach_shared
+    """
+    return fit_fold(learner, kwargs, _shared[name][1], fold, k, fraction, seed, member)
+
+
+def load_datasets(names=None):
+    """
+    names: CSV file names in Tree_based_Models/Data, None for all of them
+    Return: dict of name -> parsed 2-dim array (label in the last column)
+    """
+    if names is None:
+        names = sorted(os.path.basename(f) for f in glob.glob(os.path.join(DATA_DIR, '*.csv')))
+    return {name: np.column_stack(ds.load_cached(os.path.join(DATA_DIR, name))) for name in names}
+
+
+def run(learner, grid, data=None, k=5, fractions=(1.0,), n_jobs=-1, cache_dir=CACHE_DIR, seed=0, verbose=False,
+        member=None):
+    """
+    Run every (dataset, config, fold, fraction) combination, reusing cached results
+    learner: learner class, built as learner(**kwargs) for every config of grid
+    grid: dict mapping each kwarg to the list of values to try, see config_grid
+    member: member learner class of a wrapper learner such as BagLearner, see build_learner
+    data: dict of name -> dataset from load_datasets, None for all bundled datasets
+    fractions: share of each fold's training rows to train on (1.0 is plain k-fold)
+    n_jobs: worker processes, -1 for one per core, 1 to run in this process
+    cache_dir: directory of the cached results, None to not cache
+    Return: list of dicts, one per combination, with the dataset, config, fold,
+        fraction and the metrics of fit_fold
+    Note: raises ValueError up front if a config does not fit learner, see check_configs
+    """
+    check_configs(learner, grid, member)
+    data = load_datasets() if data is None else data
+    hashes = {name: dataset_hash(values) for name, values in data.items()}
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    rows, todo = [], []
+    for name in sorted(data):
+        for kwargs in config_grid(grid):
+            for fold in range(k):
+                for fraction in fractions:
+                    row = {'dataset': name, 'config': kwargs, 'fold': fold, 'fraction': fraction}
+                    key = task_key(learner, kwargs, hashes[name], fold, k, fraction, seed, member)
+                    path = None if cache_dir is None else os.path.join(cache_dir, key)
+                    if path is not None and os.path.exists(path):
+                        with open(path) as f:
+                            row.update(json.load(f))
+                    else:
+                        todo.append((row, path))
+                    rows.append(row)
+    if verbose:
+        print('%d results, %d cached, %d to compute' % (len(rows), len(rows) - len(todo), len(todo)))
+
+    def store(row, path, result):
+        row.update(result)
+        if path is not None: # write then rename, so an interrupted run leaves no partial file
+            tmp = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(result, f)
+            os.replace(tmp, path)
+        if verbose:
+            print('%-24s %-30s fold %d fraction %.2f rmse %.4f' % (row['dataset'], json.dumps(row['config'], default=str),
+                                                                    row['fold'], row['fraction'], row['rmse']))
+
+    n_jobs = bl.n_workers(n_jobs)
+    if n_jobs <= 1 or len(todo) <= 1:
+        for row, path in todo:
+            store(row, path, fit_fold(learner, row['config'], data[row['dataset']], row['fold'], k,
+                                      row['fraction'], seed, member))
+        return rows
+
+    blocks = []
+    try:
+        specs = {}
+        for name in sorted(set(row['dataset'] for row, path in todo)):
+            arr = np.ascontiguousarray(data[name])
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            specs[name] = (shm.name, arr.shape, arr.dtype.str)
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(todo)), initializer=attach_shared,
+                                 initargs=(specs,)) as pool:
+            jobs = {pool.submit(fit_shared_fold, learner, row['config'], row['dataset'], row['fold'], k,
+                                row['fraction'], seed, member): (row, path) for row, path in todo}
+            for job in as_completed(jobs):
+                store(*jobs[job], job.result())
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return rows
+
+
+def cross_validate(learner, grid, data=None, k=5, **options):
+    """
+    k-fold cross validation of every config of grid, see run for the options
+    """
+    return run(learner, grid, data, k, (1.0,), **options)
+
+
+def learning_curve(learner, grid, data=None, k=5, fractions=(0.1, 0.25, 0.5, 0.75, 1.0), **options):
+    """
+    Test metrics against the number of training rows, every fold trained on
+    growing shares of its training rows, see run for the options
+    """
+    return run(learner, grid, data, k, fractions, **options)
+
+
+def summarize(rows):
+    """
+    Average the folds
+    Return: list of dicts, one per (dataset, config, fraction), with n_train and
+        the mean and standard deviation over the folds of rmse, corr, train_rmse
+        and train_time
+    """
+    groups = {}
+    for row in rows:
+        key = (row['dataset'], json.dumps(row['config'], sort_keys=True, default=str), row['fraction'])
+        groups.setdefault(key, []).append(row)
+    summary = []
+    for (name, config, fraction), group in sorted(groups.items()):
+        entry = {'dataset': name, 'config': group[0]['config'], 'fraction': fraction, 'folds': len(group),
+                 'n_train': int(np.mean([row['n_train'] for row in group]))}
+        for metric in ('rmse', 'corr', 'train_rmse', 'train_time'):
+            values = [row[metric] for row in group]
+            entry[metric], entry[metric + '_std'] = float(np.mean(values)), float(np.std(values))
+        summary.append(entry)
+    return summary
+
+
+def report(summary):
+    """
+    Return: the summary as a text table
+    """
+    lines = ['%-24s %-30s %8s %8s %16s %8s %10s' % ('dataset', 'config', 'fraction', 'n_train', 'rmse', 'corr',
+                                                   'train_rmse')]
+    for s in summary:
+        lines.append('%-24s %-30s %8.2f %8d %8.4f+-%.4f %8.4f %10.4f'
+                     % (s['dataset'], json.dumps(s['config'], default=str), s['fraction'], s['n_train'],
+                        s['rmse'], s['rmse_std'], s['corr'], s['train_rmse']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-validate a learner over a grid of kwargs')
+    parser.add_argument('--learner', default='DTLearner', help='learner module, holding the class of the same name')
+    parser.add_argument('--member', help='member learner module of a wrapper learner such as BagLearner')
+    parser.add_argument('--grid', default='{"leaf_size": [1, 5, 20]}', help='JSON dict of kwarg -> list of values')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--curve', type=float, nargs='+', help='learning curve over these training fractions')
+    parser.add_argument('--dataset', action='append', help='only these CSV files of Data/')
+    parser.add_argument('--jobs', type=int, default=-1, help='worker processes, -1 for one per core')
+    parser.add_argument('--cache', default=CACHE_DIR, help='result cache directory')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='JSON file to write the per-fold results to')
+    args = parser.parse_args()
+
+    learner = getattr(importlib.import_module(args.learner), args.learner)
+    member = getattr(importlib.import_module(args.member), args.member) if args.member else None
+    try:
+        check_configs(learner, json.loads(args.grid), member)
+    except ValueError as e:
+        parser.error(str(e))
+    rows = run(learner, json.loads(args.grid), load_datasets(args.dataset), args.folds, tuple(args.curve or (1.0,)),
+               n_jobs=args.jobs, cache_dir=None if args.no_cache else args.cache, seed=args.seed, verbose=True,
+               member=member)
+    print(report(summarize(rows)))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent=1, default=str)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Datasets
+Author: Kun Gao (GT ID: 903612738)
+Reads the CSV files in Tree_based_Models/Data (and larger files of the same
+shape) in fixed-size chunks, so a file never has to fit in memory at once.
+load_cached converts a file once into binary .npy features and labels, kept in
+a npy_cache directory next to it, and memory-maps them on later loads.
+How to use:
+    import datasets as ds
+    data = ds.load_csv('../Data/Istanbul.csv') # whole file, header and date column dropped
+    Xdata, Ydata = ds.load_cached('../Data/Istanbul.csv') # parsed on first use only, then memory-mapped
+    for chunk in ds.iter_csv('big.csv', chunk_rows = 100000): # one 2-dim float array at a time
+        Xchunk, Ychunk = chunk[:, :-1], chunk[:, -1]
+"""
+from itertools import islice
+import os
+import re
+import numpy as np
+
+CACHE_DIR = 'npy_cache' # made next to a CSV file by load_cached
+
+
+def is_number(field):
+    try:
+        float(field)
+    except ValueError:
+        return False
+    return True
+
+
+def csv_layout(path, delimiter=','):
+    """
+    Work out how to read a CSV file from its first two lines
+    Return: (skiprows, usecols), 1 if the first line is a header (any field is
+        not a number) else 0, and the columns holding numbers in the first record
+        (Istanbul.csv starts with a date column)
+    """
+    with open(path) as f:
+        first = f.readline().strip().split(delimiter)
+        skiprows = 0 if all(is_number(field) for field in first) else 1
+        record = f.readline().strip().split(delimiter) if skiprows else first
+    usecols = tuple(j for j, field in enumerate(record) if is_number(field))
+    return skiprows, usecols
+
+
+def iter_csv(path, chunk_rows=100000, delimiter=','):
+    """
+    Yield the records of a CSV file as 2-dim float arrays of at most chunk_rows rows
+    Note: the header line and non-numeric columns are skipped, see csv_layout
+    """
+    skiprows, usecols = csv_layout(path, delimiter)
+    with open(path) as f:
+        for line in islice(f, skiprows):
+            pass
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                return
+            lines = [line for line in lines if line.strip()]
+            if lines:
+                yield np.loadtxt(lines, delimiter=delimiter, usecols=usecols, ndmin=2)
+
+
+def load_csv(path, delimiter=','):
+    """
+    Return: the whole CSV file as one 2-dim float array, laid out as by iter_csv
+    """
+    return np.concatenate(list(iter_csv(path, delimiter=delimiter)))
+
+
+def cache_paths(path, cache_dir=None):
+    """
+    Return: (features, labels) .npy file names of the binary cache of a CSV
+        file, keyed on its size and modification time so an edited file is
+        converted again
+    cache_dir: None for a npy_cache directory next to path
+    """
+    info = os.stat(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    stem = os.path.join(cache_dir, '%s.%d.%d' % (os.path.basename(path), info.st_size, info.st_mtime_ns))
+    return stem + '.x.npy', stem + '.y.npy'
+
+
+def convert(path, delimiter=',', cache_dir=None):
+    """
+    Parse a CSV file (header and date column dropped, see csv_layout) and write
+    its features and labels (last column) as the .npy files of cache_paths
+    Note: the files of older versions of the CSV file are removed, and each file
+    is written under a temporary name then renamed, so an interrupted conversion
+    leaves no partial cache
+    """
+    x_path, y_path = cache_paths(path, cache_dir) # stat before parsing: an edit meanwhile gets a new key
+    data = load_csv(path, delimiter)
+    folder = os.path.dirname(x_path)
+    os.makedirs(folder, exist_ok=True)
+    stale = re.compile(re.escape(os.path.basename(path)) + r'\.\d+\.\d+\.[xy]\.npy')
+    for name in os.listdir(folder):
+        if stale.fullmatch(name) and os.path.join(folder, name) not in (x_path, y_path):
+            os.remove(os.path.join(folder, name))
+    for target, values in ((y_path, data[:, -1]), (x_path, data[:, :-1])): # features last, see load_cached
+        tmp = '%s.%d.tmp' % (target, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(values))
+        os.replace(tmp, target)
+    return x_path, y_path
+
+
+def load_cached(path, delimiter=',', mmap=True, cache_dir=None):
+    """
+    Load a CSV file through its binary cache, converting it on first use and
+    whenever its size or modification time changed
+    mmap: memory-map the cached arrays read-only instead of reading them, so
+        only the rows used are read from disk
+    cache_dir: where the .npy files go, None for a npy_cache directory next to path
+    Return: (data_x, data_y), the features as a 2-dim float array and the labels
+        (last column) as a 1-dim float array, laid out as by load_csv
+    """
+    x_path, y_path = cache_paths(path, cache_dir)
+    if not os.path.exists(x_path): # written last by convert
+        x_path, y_path = convert(path, delimiter, cache_dir)
+    mode = 'r' if mmap else None
+    return np.load(x_path, mmap_mode=mode), np.load(y_path, mmap_mode=mode)
@@ -0,0 +1,346 @@
+"""
+Histogram Tree Builder
+Author: Kun Gao (GT ID: 903612738)
+Builds trees from features quantized once into uint8 bins, so every node works
+on small per-bin histograms instead of the raw float data.
+How to use:
+    import histtree as ht
+    bins, edges = ht.bin_features(Xtrain, max_bins = 256)
+    model = ht.build_tree_hist(bins, edges, Ytrain, leaf_size, find_feature)
+    Y = model.query(Xtest) # thresholds are real values, query takes raw data
+    edges = ht.sketch_edges(chunks, max_bins = 256) # out of core: chunks() yields (x, y) pairs
+    model = ht.build_tree_stream(chunks, edges, leaf_size, find_feature)
+"""
+import time
+import numpy as np
+import treeutil as tu
+
+
+def bin_features(data_x, max_bins=256):
+    """
+    Quantize every feature into at most max_bins (<= 256) bins
+    data_x: A set of feature values used to train the learner
+    Return: (bins, edges) where bins is a uint8 array shaped like data_x and
+        edges[j, b] is the largest value that falls into bin b of feature j
+    Note: a feature with few distinct values gets one bin per value, otherwise
+    the edges are its quantiles (both read off one sort of the column). Rows
+    past the last used bin of a feature repeat its maximum, so np.searchsorted
+    on a full row of edges is still valid.
+    """
+    if max_bins > 256:
+        raise ValueError('max_bins can be at most 256 for uint8 bins')
+    nrec, n_feat = np.shape(data_x)
+    bins = np.empty((nrec, n_feat), dtype=np.uint8)
+    edges = np.empty((n_feat, max_bins), dtype=tu.value_dtype(data_x))
+    for j in np.arange(n_feat):
+        column = data_x[:, j]
+        ordered = np.sort(column)
+        cuts = ordered[np.concatenate(([True], ordered[1:] != ordered[:-1]))] # np.unique, without a second sort
+        if len(cuts) > max_bins:
+            cuts = np.unique(np.quantile(ordered, np.linspace(0, 1, max_bins + 1)[1:]))
+        edges[j, :len(cuts)] = cuts
+        edges[j, len(cuts):] = cuts[-1]
+        bins[:, j] = np.searchsorted(cuts, column, side='left')
+    return bins, edges
+
+
+def node_histograms(bins, data_y, rows, n_bins):
+    """
+    Return: (count, ysum), two (features, n_bins) arrays with the number of
+        records and the sum of their labels in every bin of every feature
+    Note: one feature at a time, straight from the uint8 bins of the records
+    (1 byte per cell), so the only temporaries are one column and the labels
+    """
+    n_feat = np.shape(bins)[1]
+    sub, ys = bins[rows], data_y[rows]
+    count = np.empty((n_feat, n_bins), dtype=np.intp)
+    ysum = np.empty((n_feat, n_bins))
+    for j in np.arange(n_feat):
+        count[j] = np.bincount(sub[:, j], minlength=n_bins)
+        ysum[j] = np.bincount(sub[:, j], ys, minlength=n_bins)
+    return count, ysum
+
+
+def median_bin(count):
+    """
+    Find the bin holding the median record from the cumulative bin counts
+    count: 1-dim array with the number of records in each bin
+    Return: the bin index b such that splitting at bins <= b puts the lower half left
+    """
+    cum = np.cumsum(count)
+    return int(np.searchsorted(cum, (cum[-1] + 1) // 2, side='left'))
+
+
+def build_tree_hist(bins, edges, data_y, leaf_size, find_feature, return_leaves=False, rows=None,
+                    return_stats=False, profile=None, max_depth=None):
+    """
+    Build a regression tree from binned features, without recursion
+    bins, edges: the output of bin_features
+    data_y: The value we are attempting to predict given the X data
+    leaf_size: nodes with at most this many records become leaves
+    find_feature: called as find_feature(count, ysum, ys) with the histograms and
+        labels of the records reaching a node, returns the feature to split on
+    return_leaves: also return the leaf of every training row, see tu.build_tree
+    rows: indices of the records to train on (repeats allowed), None for all
+    return_stats: also return node record counts and label sums, see tu.build_tree
+    profile: a profiling.Profile to add phase timings and tree counters to
+    max_depth: nodes this deep become leaves, None for no limit
+    Return: a TreeModel describing the tree, split values taken from edges
+    Note: a node splits at the bin of its median (from cumulative counts). Only
+    the smaller child's histograms are counted from its records, the larger
+    child's are the parent's minus the smaller's.
+    """
+    if rows is not None:
+        rows = np.asarray(rows)
+    nrec = np.shape(bins)[0] if rows is None else len(rows)
+    n_bins = np.shape(edges)[1]
+    perm = np.arange(nrec) # positions in rows (or records when rows is None)
+    table = tu.NodeTable(dtype=edges.dtype)
+    leaves = np.zeros(nrec, dtype=np.int32)
+    records = perm if rows is None else rows
+    if profile is not None:
+        find_feature = profile.timed('split', find_feature)
+        table.profile = profile
+
+    count, ysum = node_histograms(bins, data_y, records, n_bins)
+    stack = [(0, nrec, -1, 0, count, ysum)]
+    while stack:
+        lo, hi, parent, depth, count, ysum = stack.pop()
+        ti = table.new_node()
+        if parent >= 0:
+            table.right[parent] = ti - parent
+
+        pos = perm[lo:hi]
+        records = pos if rows is None else rows[pos]
+        ys = data_y[records]
+        n = hi - lo
+        mean = np.sum(ysum[0]) / n if n > 0 else np.nan
+        if return_stats:
+            table.count[ti], table.total[ti] = n, np.sum(ys)
+        if n <= leaf_size: # if all data can fit in the same leaf
+            table.set_leaf(ti, mean)
+            leaves[pos] = ti
+            continue
+        if np.max(ys) == np.min(ys): # if all labels are the same
+            table.set_leaf(ti, ys[0])
+            leaves[pos] = ti
+            continue
+        if depth == max_depth:
+            table.set_leaf(ti, mean)
+            leaves[pos] = ti
+            continue
+
+        idx = find_feature(count, ysum, ys)
+        if profile is not None:
+            since = time.perf_counter()
+        b = median_bin(count[idx])
+        n_left = int(np.sum(count[idx, :b + 1]))
+        if profile is not None:
+            since = profile.lap('median', since)
+        if n_left == n: # all data on the same side
+            table.set_leaf(ti, mean)
+            leaves[pos] = ti
+            continue
+
+        go_left = bins[records, idx] <= b
+        perm[lo:hi] = np.concatenate((pos[go_left], pos[~go_left]))
+        if profile is not None:
+            since = profile.lap('partition', since)
+            profile.partition_bytes += 2 * (pos.nbytes + go_left.nbytes)
+        table.set_split(ti, idx, edges[idx, b])
+
+        records = perm[lo:hi] if rows is None else rows[perm[lo:hi]]
+        if n_left <= n - n_left:
+            count_l, ysum_l = node_histograms(bins, data_y, records[:n_left], n_bins)
+            count_r, ysum_r = count - count_l, ysum - ysum_l
+        else:
+            count_r, ysum_r = node_histograms(bins, data_y, records[n_left:], n_bins)
+            count_l, ysum_l = count - count_r, ysum - ysum_r
+        if profile is not None:
+            profile.lap('histogram', since)
+        stack.append((lo + n_left, hi, ti, depth + 1, count_r, ysum_r)) # right, after the left subtree
+        stack.append((lo, lo + n_left, -1, depth + 1, count_l, ysum_l))
+
+    result = table.result(leaves if return_leaves else None, return_stats)
+    if profile is not None:
+        profile.add_tree(result[0] if isinstance(result, tuple) else result)
+    return result
+
+
+def hist_correlation(count, ysum, edges, yss):
+    """
+    |cor| between every binned feature and the labels, from the node histograms
+    count, ysum: (features, bins) histograms of the node
+    edges: (features, bins) value that stands for each bin
+    yss: sum of squared deviations of the labels reaching the node from their mean
+    Return: 1-dim array with |cor| of each feature, 0 for constant features
+    """
+    n = np.sum(count[0])
+    ymean = np.sum(ysum[0]) / n
+    xmean = np.sum(count * edges, axis=1) / n
+    xc = edges - xmean[:, None]
+    cov = np.sum((ysum - count * ymean) * xc, axis=1)
+    var = np.sum(count * xc * xc, axis=1) * yss
+    cor = np.zeros(len(cov))
+    ok = var > 0
+    cor[ok] = np.abs(cov[ok]) / np.sqrt(var[ok])
+    return cor
+
+
+def sketch_edges(chunks, max_bins=256, sample_rows=100000):
+    """
+    Pick bin edges like bin_features in one pass over data that does not fit in memory
+    chunks: called without arguments, returns a fresh iterator of (x, y) chunks
+    max_bins: at most 256 bins per feature
+    sample_rows: size of the uniform reservoir sample the quantiles come from
+    Return: (features, max_bins) edges, see bin_features
+    Note: a feature keeps one bin per distinct value while it has at most
+    max_bins of them, otherwise its edges are quantiles of the sample with the
+    last one moved to the true maximum, so no record falls past the last bin.
+    """
+    if max_bins > 256:
+        raise ValueError('max_bins can be at most 256 for uint8 bins')
+    nrec = 0
+    sample, distinct, colmax = None, None, None
+    for x, y in chunks():
+        n, n_feat = np.shape(x)
+        if sample is None:
+            sample = np.empty((sample_rows, n_feat))
+            distinct = [np.empty(0)] * n_feat
+            colmax = np.full(n_feat, -np.inf)
+        colmax = np.maximum(colmax, np.max(x, axis=0))
+        for j in np.arange(n_feat):
+            if distinct[j] is not None:
+                distinct[j] = np.union1d(distinct[j], x[:, j])
+                if len(distinct[j]) > max_bins:
+                    distinct[j] = None
+        # reservoir sampling: record t replaces a random slot with probability sample_rows / (t + 1)
+        t = nrec + np.arange(n)
+        fill = t < sample_rows
+        sample[t[fill]] = x[fill]
+        if not np.all(fill):
+            slot = np.random.randint(0, t[~fill] + 1)
+            keep = slot < sample_rows
+            sample[slot[keep]] = x[~fill][keep]
+        nrec += n
+    if nrec == 0:
+        raise ValueError('no records to sketch')
+    sample = sample[:min(nrec, sample_rows)]
+    edges = np.empty((n_feat, max_bins))
+    for j in np.arange(n_feat):
+        cuts = distinct[j]
+        if cuts is None:
+            cuts = np.unique(np.quantile(sample[:, j], np.linspace(0, 1, max_bins + 1)[1:]))
+            cuts[-1] = colmax[j]
+        edges[j, :len(cuts)] = cuts
+        edges[j, len(cuts):] = cuts[-1]
+    return edges
+
+
+def route(table, x):
+    """
+    Return: the node of a partially built NodeTable each row of x ends up in
+    """
+    n = table.n_nodes
+    feature, value, leaf = table.feature[:n], table.value[:n], table.leaf[:n]
+    left, right = table.left[:n], table.right[:n]
+    node = np.zeros(np.shape(x)[0], dtype=np.intp)
+    active = np.flatnonzero(~leaf[node])
+    while active.size > 0:
+        ti = node[active]
+        go_left = x[active, feature[ti]] <= value[ti]
+        ti = ti + np.where(go_left, left[ti], right[ti])
+        node[active] = ti
+        active = active[~leaf[ti]]
+    return node
+
+
+def build_tree_stream(chunks, edges, leaf_size, find_feature, max_nodes=1024, max_depth=None):
+    """
+    Build the same tree as build_tree_hist from data that does not fit in memory,
+    one tree level per pass over the data
+    chunks: called without arguments, returns a fresh iterator of (x, y) chunks
+    edges: bin edges, see sketch_edges
+    leaf_size: nodes with at most this many records become leaves
+    find_feature: called as find_feature(count, ysum, yss) with the histograms of
+        a node and the sum of squared deviations of its labels, returns the
+        feature to split on
+    max_nodes: nodes whose histograms are gathered in the same pass; a wider
+        level takes several passes
+    max_depth: nodes this deep become leaves (predicting their mean) without
+        a pass, None for no limit
+    Return: a TreeModel describing the tree, nodes stored level by level
+    Note: each pass routes every chunk through the levels built so far and adds
+    the records reaching an open node to its histograms, so memory is bounded by
+    the chunk size and max_nodes x features x bins. A child whose record count
+    (known from its parent's histograms) is at most leaf_size is closed right
+    away without a pass.
+    """
+    n_feat, n_bins = np.shape(edges)
+    table = tu.NodeTable(dtype=edges.dtype)
+    frontier = [table.new_node()]
+    table.set_leaf(frontier[0], np.nan) # open nodes are placeholder leaves until decided
+    depth = {frontier[0]: 0} # of the open nodes
+    shift = None # labels are shifted by a rough mean before squaring
+    while frontier:
+        group, frontier = frontier[:max_nodes], frontier[max_nodes:]
+        size = len(group)
+        slot_of = np.full(table.n_nodes, -1)
+        slot_of[group] = np.arange(size)
+        count = np.zeros(size * n_feat * n_bins)
+        ysum = np.zeros(size * n_feat * n_bins)
+        n, s1, s2 = np.zeros(size), np.zeros(size), np.zeros(size)
+        ymin, ymax = np.full(size, np.inf), np.full(size, -np.inf)
+        for x, y in chunks():
+            if shift is None:
+                shift = np.mean(y)
+            slot = slot_of[route(table, x)]
+            sel = slot >= 0
+            x, y, slot = x[sel], y[sel], slot[sel]
+            bins = np.empty(np.shape(x), dtype=np.intp)
+            for j in np.arange(n_feat):
+                bins[:, j] = np.searchsorted(edges[j], x[:, j], side='left')
+            flat = ((slot[:, None] * n_feat + np.arange(n_feat)) * n_bins + bins).ravel()
+            count += np.bincount(flat, minlength=len(count))
+            ysum += np.bincount(flat, np.repeat(y, n_feat), minlength=len(ysum))
+            n += np.bincount(slot, minlength=size)
+            s1 += np.bincount(slot, y, minlength=size)
+            s2 += np.bincount(slot, (y - shift) ** 2, minlength=size)
+            np.minimum.at(ymin, slot, y)
+            np.maximum.at(ymax, slot, y)
+        count = count.reshape(size, n_feat, n_bins)
+        ysum = ysum.reshape(size, n_feat, n_bins)
+
+        for k, ti in enumerate(group):
+            mean = s1[k] / n[k] if n[k] > 0 else np.nan
+            if n[k] <= leaf_size: # if all data can fit in the same leaf
+                table.set_leaf(ti, mean)
+                continue
+            if ymax[k] == ymin[k]: # if all labels are the same
+                table.set_leaf(ti, ymin[k])
+                continue
+            if depth[ti] == max_depth: # only the root, deeper nodes are closed without a pass
+                table.set_leaf(ti, mean)
+                continue
+
+            yss = max(s2[k] - n[k] * (mean - shift) ** 2, 0.0)
+            idx = find_feature(count[k], ysum[k], yss)
+            b = median_bin(count[k, idx])
+            n_left = np.sum(count[k, idx, :b + 1])
+            if n_left == n[k]: # all data on the same side
+                table.set_leaf(ti, mean)
+                continue
+
+            table.set_split(ti, idx, edges[idx, b])
+            sum_left = np.sum(ysum[k, idx, :b + 1])
+            for side, cn, cs in (('left', n_left, sum_left), ('right', n[k] - n_left, s1[k] - sum_left)):
+                child = table.new_node() # may reallocate the table arrays
+                getattr(table, side)[ti] = child - ti
+                if cn <= leaf_size or depth[ti] + 1 == max_depth:
+                    table.set_leaf(child, cs / cn)
+                else:
+                    table.set_leaf(child, np.nan)
+                    frontier.append(child)
+                    depth[child] = depth[ti] + 1
+
+    return table.to_model()
@@ -0,0 +1,239 @@
+"""
+Equivalence Tests
+Author: Kun Gao (GT ID: 903612738)
+Checks the faster code paths against the plain algorithm they replace, on the
+CSV files in Tree_based_Models/Data.
+How to use:
+    python -m pytest test_equivalence.py
+"""
+import glob
+import json
+import os
+import numpy as np
+import pytest
+import datasets as ds
+import DTLearner as dt
+import RTLearner as rt
+import BagLearner as bl
+import InsaneLearner as it
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+FILES = sorted(os.path.basename(f) for f in glob.glob(os.path.join(DATA_DIR, '*.csv')))
+
+
+def load(name):
+    """
+    Return: (data_x, data_y) of a bundled dataset
+    """
+    data = ds.load_csv(os.path.join(DATA_DIR, name))
+    return data[:, :-1], data[:, -1]
+
+
+def walk(tree, points):
+    """
+    Reference query: one row at a time down the 4-column node table
+    (leaves as [-999, value, nan, nan])
+    """
+    pred = np.zeros(len(points))
+    for i in np.arange(len(points)):
+        ti = 0
+        while tree[ti, 0] > -900: # if not a leaf
+            if points[i, int(tree[ti, 0])] <= tree[ti, 1]:
+                ti += int(tree[ti, 2]) # left
+            else:
+                ti += int(tree[ti, 3]) # right
+        pred[i] = tree[ti, 1]
+    return pred
+
+
+@pytest.mark.parametrize('learner', [dt.DTLearner, rt.RTLearner])
+@pytest.mark.parametrize('name', FILES)
+def test_query_matches_row_walk(learner, name):
+    data_x, data_y = load(name)
+    np.random.seed(0)
+    model = learner(leaf_size=5)
+    model.add_evidence(data_x, data_y)
+    points = data_x + np.random.normal(0, 0.01, size=data_x.shape) # off the split values as well as on them
+    for rows in (data_x, points):
+        assert np.array_equal(model.query(rows), walk(model.tree.to_array(), rows))
+
+
+def recursive_tree(data_x, data_y, leaf_size, find_feature):
+    """
+    Reference build: the recursive algorithm of the Balch slides on copies of
+    the node data, find_feature(x, y) choosing the split feature
+    Return: the 4-column node table
+    """
+    if data_x.shape[0] <= leaf_size: # if all data can fit in the same leaf
+        return np.array([[-999, np.mean(data_y), np.nan, np.nan]])
+    if np.max(data_y) == np.min(data_y): # if all labels are the same
+        return np.array([[-999, data_y[0], np.nan, np.nan]])
+    idx = find_feature(data_x, data_y)
+    split_val = np.median(data_x[:, idx])
+    go_left = data_x[:, idx] <= split_val
+    if np.all(go_left): # all data on the same side
+        return np.array([[-999, np.mean(data_y), np.nan, np.nan]])
+    left = recursive_tree(data_x[go_left], data_y[go_left], leaf_size, find_feature)
+    right = recursive_tree(data_x[~go_left], data_y[~go_left], leaf_size, find_feature)
+    return np.vstack(([[idx, split_val, 1, len(left) + 1]], left, right))
+
+
+FINDERS = {'DTLearner': (dt.DTLearner, lambda x, y: dt.DTLearner.find_feature_idx(x, y)),
+           'RTLearner': (rt.RTLearner, lambda x, y: rt.RTLearner.find_feature_idx(x))}
+
+
+@pytest.mark.parametrize('leaf_size', [1, 5])
+@pytest.mark.parametrize('learner', sorted(FINDERS))
+@pytest.mark.parametrize('name', FILES)
+def test_build_matches_recursive(learner, name, leaf_size):
+    data_x, data_y = load(name)
+    cls, find_feature = FINDERS[learner]
+    np.random.seed(3) # RTLearner draws its features in the same (depth first) order
+    expected = recursive_tree(data_x, data_y, leaf_size, find_feature)
+    np.random.seed(3)
+    model = cls(leaf_size=leaf_size)
+    model.add_evidence(data_x, data_y)
+    assert np.array_equal(model.tree.to_array(), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('histogram', [False, True])
+@pytest.mark.parametrize('name', FILES)
+def test_prune_matches_rebuild(name, histogram):
+    data_x, data_y = load(name)
+    full = dt.DTLearner(grow_full=True, histogram=histogram)
+    full.add_evidence(data_x, data_y)
+    grid = [1, 2, 5, 10, 50]
+    for leaf_size in grid:
+        model = dt.DTLearner(leaf_size=leaf_size, histogram=histogram)
+        model.add_evidence(data_x, data_y)
+        assert np.allclose(full.prune(leaf_size).to_array(), model.tree.to_array(), rtol=1e-12, atol=0,
+                           equal_nan=True) # leaf means from label sums, up to round-off
+    points = data_x + np.random.RandomState(0).normal(0, 0.01, size=data_x.shape)
+    expected = [full.prune(leaf_size).query(points) for leaf_size in grid]
+    assert np.allclose(full.query_leaf_sizes(points, grid), expected, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize('n_jobs', [2, 4])
+@pytest.mark.parametrize('kwargs', [{'leaf_size': 1}, {'leaf_size': 5, 'max_depth': 4}, {'grow_full': True}])
+@pytest.mark.parametrize('name', FILES)
+def test_parallel_matches_serial(name, kwargs, n_jobs):
+    data_x, data_y = load(name)
+    models = []
+    for jobs in (1, n_jobs):
+        model = dt.DTLearner(n_jobs=jobs, keep_leaves=True, **kwargs)
+        model.add_evidence(data_x, data_y)
+        models.append(model)
+    serial, parallel = models
+    assert np.array_equal(parallel.tree.to_array(), serial.tree.to_array(), equal_nan=True)
+    assert np.array_equal(parallel.train_leaves, serial.train_leaves)
+    if serial.full_tree is not None: # and the node statistics pruning reads
+        assert np.array_equal(parallel.node_count, serial.node_count)
+        assert np.array_equal(parallel.node_total, serial.node_total)
+
+
+def corrcoef_feature(x, y):
+    """
+    Reference split feature: the original np.corrcoef loop (first strictly larger |cor| wins)
+    """
+    cor_max, i_max = 0, 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in np.arange(np.shape(x)[1]):
+            cor = np.abs(np.corrcoef(x[:, i], y)[0, 1])
+            if cor > cor_max:
+                cor_max, i_max = cor, i
+    return i_max
+
+
+@pytest.mark.parametrize('cor, expected', [([0.5, 0.9, 0.9 + dt.COR_TIE / 10, 0.3], 1), # a round-off tie: first wins
+                                           ([0.5, 0.9, 0.9 + 10 * dt.COR_TIE, 0.3], 2), # a real difference
+                                           ([0.0, 0.0, 0.0], 0)]) # no usable feature
+def test_feature_tie_rule(monkeypatch, cor, expected):
+    monkeypatch.setattr(dt.DTLearner, 'feature_cor', staticmethod(lambda x, y: np.array(cor)))
+    assert dt.DTLearner.find_feature_idx(None, None) == expected
+
+
+def test_feature_ties_go_to_first_column():
+    rng = np.random.RandomState(0)
+    x = rng.randn(50, 3)
+    y = 2 * x[:, 1] + 0.1 * rng.randn(50)
+    assert dt.DTLearner.find_feature_idx(x, y) == 1
+    assert dt.DTLearner.find_feature_idx(np.column_stack((x[:, 1], x)), y) == 0 # duplicated column
+    assert dt.DTLearner.find_feature_idx(np.column_stack((x, -3 * x[:, 1])), y) == 1 # scaled and mirrored copy
+    assert dt.DTLearner.find_feature_idx(np.array([[1., 2.], [2., 4.]]), np.array([0., 1.])) == 0 # |cor| = 1 twice
+
+
+@pytest.mark.parametrize('name', FILES)
+def test_feature_matches_corrcoef_without_ties(name):
+    data_x, data_y = load(name)
+    rng = np.random.RandomState(0)
+    for size in (3, 10, 50, 200):
+        for i in np.arange(20):
+            rows = rng.choice(len(data_x), size=min(size, len(data_x)), replace=False)
+            x, y = data_x[rows], data_y[rows]
+            cor = np.sort(dt.DTLearner.feature_cor(x, y))
+            if len(cor) > 1 and cor[-1] - cor[-2] < 1e-9: # a near-tie, the rules may differ there
+                continue
+            assert dt.DTLearner.find_feature_idx(x, y) == corrcoef_feature(x, y)
+
+
+@pytest.mark.parametrize('bags', [1, 3])
+@pytest.mark.parametrize('boost', [False, True])
+def test_compiled_bags_match_members(tmp_path, bags, boost):
+    data_x, data_y = load('Istanbul.csv')
+    np.random.seed(0)
+    kwargs = {'leaf_size': 5, 'max_depth': 3} if boost else {'leaf_size': 5}
+    learner = bl.BagLearner(dt.DTLearner if boost else rt.RTLearner, kwargs, bags, boost=boost)
+    learner.add_evidence(data_x, data_y)
+    expected = learner.query(data_x) # member by member
+    assert learner.compile()
+    assert np.allclose(learner.query(data_x), expected, rtol=0, atol=1e-12)
+    learner.save(str(tmp_path / 'model'))
+    loaded = bl.BagLearner.load(str(tmp_path / 'model'))
+    assert np.allclose(loaded.query(data_x), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('name', ['Istanbul.csv', 'winequality-red.csv'])
+def test_insane_learner_matches_bootstrap_lstsq(name):
+    data_x, data_y = load(name)
+    np.random.seed(0)
+    learner = it.InsaneLearner()
+    learner.add_evidence(data_x, data_y)
+    np.random.seed(0) # the same draws, as 20 BagLearners of 20 bags make them
+    x = np.column_stack((data_x, np.ones(len(data_x))))
+    coefs = []
+    for i in np.arange(20):
+        for index_sel in bl.draw_bootstrap(20, len(data_x))[1]:
+            coefs.append(np.linalg.lstsq(x[index_sel], data_y[index_sel], rcond=None)[0])
+    expected = np.dot(x, np.mean(coefs, axis=0))
+    assert np.allclose(learner.query(data_x), expected, rtol=1e-9, atol=1e-12)
+
+
+def test_load_rejects_unknown_member(tmp_path):
+    data_x, data_y = load('simple.csv')
+    learner = bl.BagLearner(rt.RTLearner, {'leaf_size': 5}, 2)
+    learner.add_evidence(data_x, data_y)
+    learner.save(str(tmp_path))
+    with open(str(tmp_path / 'header.json')) as f:
+        header = json.load(f)
+    header['member'] = 'os'
+    with open(str(tmp_path / 'header.json'), 'w') as f:
+        json.dump(header, f)
+    with pytest.raises(ValueError):
+        bl.BagLearner.load(str(tmp_path))
+
+
+@pytest.mark.parametrize('learner', [dt.DTLearner, rt.RTLearner])
+def test_retraining_drops_full_tree(learner):
+    data_x, data_y = load('Istanbul.csv')
+    model = learner(leaf_size=5, grow_full=True, incremental=True)
+    model.add_evidence(data_x[:400], data_y[:400])
+    model.prune(10)
+    model.update(data_x[400:], data_y[400:]) # the full tree has not seen these rows
+    for sweep in (lambda: model.prune(10), lambda: model.query_leaf_sizes(data_x, [5, 10])):
+        with pytest.raises(ValueError):
+            sweep()
+    model.add_evidence(data_x, data_y)
+    model.prune(10)
+    model.add_evidence_csv(os.path.join(DATA_DIR, 'Istanbul.csv'))
+    with pytest.raises(ValueError):
+        model.prune(10)
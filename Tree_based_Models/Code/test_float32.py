@@ -0,0 +1,57 @@
+"""
+Float32 Drift Tests
+Author: Kun Gao (GT ID: 903612738)
+Bounds how far trees trained with dtype=np.float32 drift from the float64 ones
+on the CSV files in Tree_based_Models/Data.
+How to use:
+    python -m pytest test_float32.py
+"""
+import glob
+import os
+import numpy as np
+import pytest
+import datasets as ds
+import DTLearner as dt
+import RTLearner as rt
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data')
+FILES = sorted(os.path.basename(f) for f in glob.glob(os.path.join(DATA_DIR, '*.csv')))
+LEARNERS = {'DTLearner': (dt.DTLearner, {}), 'DTLearner-histogram': (dt.DTLearner, {'histogram': True}),
+            'RTLearner': (rt.RTLearner, {})}
+RMSE_TOL = 0.0025 # largest test RMSE change float32 may cause
+MOVED_TOL = 0.01 # largest share of test rows float32 may send to another leaf
+
+
+def train_both(learner, kwargs, name):
+    """
+    Train the learner in float64 and in float32 on the same 60% of a dataset
+    Return: (model64, model32, pred64, pred32, test labels)
+    """
+    data = ds.load_csv(os.path.join(DATA_DIR, name))
+    np.random.seed(0)
+    order = np.random.permutation(data.shape[0])
+    n_train = int(0.6 * data.shape[0])
+    train, test = data[order[:n_train]], data[order[n_train:]]
+    result = []
+    for dtype in (np.float64, np.float32):
+        np.random.seed(1) # same random features for RTLearner
+        model = learner(leaf_size=5, dtype=dtype, **kwargs)
+        model.add_evidence(train[:, :-1], train[:, -1])
+        result.append((model.tree, model.query(test[:, :-1])))
+    (tree64, pred64), (tree32, pred32) = result
+    return tree64, tree32, pred64, pred32, test[:, -1]
+
+
+@pytest.mark.parametrize('learner', sorted(LEARNERS))
+@pytest.mark.parametrize('name', FILES)
+def test_float32_drift(learner, name):
+    tree64, tree32, pred64, pred32, test_y = train_both(*LEARNERS[learner], name)
+    assert tree32.value.dtype == np.float32 and pred32.dtype == np.float32
+    # the same splits on the same features, only the values are rounded
+    assert np.array_equal(tree64.feature, tree32.feature)
+    assert np.array_equal(tree64.left, tree32.left) and np.array_equal(tree64.right, tree32.right)
+    rmse = lambda pred: np.sqrt(np.mean((pred - test_y) ** 2))
+    assert abs(rmse(pred32) - rmse(pred64)) <= RMSE_TOL
+    # rows away from a split threshold get the float64 prediction up to rounding
+    moved = np.abs(pred32 - pred64) > 1e-5 * (1 + np.abs(pred64))
+    assert np.mean(moved) <= MOVED_TOL
@@ -0,0 +1,441 @@
+"""
+Tree Utilities
+Author: Kun Gao (GT ID: 903612738)
+Helpers shared by the tree learners (DTLearner, RTLearner).
+How to use:
+    import treeutil as tu
+    model = tu.build_tree(Xtrain, Ytrain, leaf_size, find_feature)
+    Y = model.query(Xtest)
+    updater = tu.TreeUpdater(model, Xtrain, Ytrain, leaf_size) # keeps the rows of every leaf
+    updater.update(Xnew, Ynew, feature_finder) # adds rows to model in place
+    model, count, total = tu.build_tree(Xtrain, Ytrain, 1, find_feature, return_stats=True)
+    model5 = tu.prune(model, count, total, 5) # the leaf_size = 5 tree, without rebuilding
+    Y_grid = tu.query_leaf_sizes(model, count, total, Xtest, [1, 5, 10]) # one row per leaf_size
+    with ThreadPoolExecutor(4) as pool: # same tree as build_tree, subtrees grown on 4 threads
+        model = tu.build_tree_parallel(Xtrain, Ytrain, leaf_size, find_feature, pool, 4)
+"""
+import time
+import numpy as np
+import TreeModel as tm
+import profiling as pf
+
+
+class NodeTable(object):
+    """
+    Node table filled in by the tree builders, doubles in size whenever it fills up
+    """
+
+    def __init__(self, capacity=64, dtype=np.float64):
+        self.n_nodes = 0
+        self.feature = np.empty(capacity, dtype=np.int32)
+        self.value = np.empty(capacity, dtype=dtype) # float32 for float32 features, see value_dtype
+        self.left = np.empty(capacity, dtype=np.int32)
+        self.right = np.empty(capacity, dtype=np.int32)
+        self.leaf = np.empty(capacity, dtype=bool)
+        self.count = np.zeros(capacity, dtype=np.int64) # records reaching each node, if recorded
+        self.total = np.zeros(capacity) # sum of their labels
+        self.profile = None # profiling.Profile timing the growth, if any
+
+    def new_node(self):
+        """
+        Reserve the next row of the table and return its index
+        """
+        if self.n_nodes == len(self.leaf):
+            since = time.perf_counter()
+            for name in ('feature', 'value', 'left', 'right', 'leaf', 'count', 'total'):
+                old = getattr(self, name)
+                grown = np.empty(2 * len(old), dtype=old.dtype)
+                grown[:self.n_nodes] = old
+                setattr(self, name, grown)
+            if self.profile is not None:
+                self.profile.lap('growth', since)
+        self.n_nodes += 1
+        return self.n_nodes - 1
+
+    def set_leaf(self, ti, value):
+        self.feature[ti], self.value[ti], self.leaf[ti] = -1, value, True
+        self.left[ti], self.right[ti] = 0, 0
+
+    def set_split(self, ti, feature, value):
+        self.feature[ti], self.value[ti], self.leaf[ti] = feature, value, False
+        self.left[ti], self.right[ti] = 1, 0
+
+    def to_model(self):
+        n = self.n_nodes
+        return tm.TreeModel(self.feature[:n], self.value[:n], self.left[:n],
+                            self.right[:n], self.leaf[:n])
+
+    def result(self, leaves=None, stats=False):
+        """
+        Return: the TreeModel, followed by leaves if given and by the node counts
+        and label sums if stats, as returned by the tree builders
+        """
+        n = self.n_nodes
+        result = (self.to_model(),)
+        if leaves is not None:
+            result += (leaves,)
+        if stats:
+            result += (self.count[:n].copy(), self.total[:n].copy())
+        return result if len(result) > 1 else result[0]
+
+
+def value_dtype(data_x):
+    """
+    Return: the dtype trees trained on data_x store split values and predictions
+        in, float32 for float32 (or narrower) features and float64 otherwise
+    """
+    return np.result_type(np.asarray(data_x).dtype, np.float32)
+
+
+def random_split_value(column):
+    """
+    Extra-trees split value: the mean of the values of two records drawn at
+    random from column, so picking it takes constant time
+    """
+    n = len(column)
+    return (column[np.random.randint(0, n)] + column[np.random.randint(0, n)]) / 2
+
+
+def build_tree(data_x, data_y, leaf_size, find_feature, leaf_value=np.mean, return_leaves=False, rows=None,
+               return_stats=False, profile=None, max_depth=None, split_value=np.median):
+    """
+    Build a decision tree based on the algorithm in Balch slides, without recursion
+    data_x: A set of feature values used to train the learner
+    data_y: The value we are attempting to predict given the X data
+    leaf_size: nodes with at most this many records become leaves
+    find_feature: called as find_feature(rows, ys) with the indices and labels of
+        the records reaching a node, returns the index of the feature to split on
+    leaf_value: turns the labels reaching a leaf into its prediction
+    return_leaves: also return the leaf of every training row, as recorded while
+        building (no extra traversal)
+    rows: indices of the records of data_x to train on (repeats allowed, e.g. a
+        bootstrap sample), None for all of them; the data is never copied
+    return_stats: also return the number of records reaching every node and the
+        sum of their labels, see prune
+    profile: a profiling.Profile to add phase timings and tree counters to
+    max_depth: nodes this deep (the root has depth 0) become leaves, None for no limit
+    split_value: turns the split feature's values at a node into the split value,
+        np.median or e.g. random_split_value; when a value other than the median
+        sends every record left, the node splits at the median instead
+    Return: a TreeModel describing the tree, and with return_leaves an int32
+        array with the leaf node index of every training row (of every entry
+        of rows when given), then with return_stats the two node arrays
+    Note: the records of each node are a contiguous slice of a single index
+    permutation that is partitioned in place when the node splits. Nodes are
+    written depth first (left child next, right child after the whole left
+    subtree) into a NodeTable.
+    """
+    if rows is not None:
+        rows = np.asarray(rows)
+    nrec = np.shape(data_x)[0] if rows is None else len(rows)
+    perm = np.arange(nrec) # positions in rows (or records of data_x when rows is None)
+    table = NodeTable(dtype=value_dtype(data_x))
+    leaves = np.zeros(nrec, dtype=np.int32)
+    if profile is not None:
+        find_feature = profile.timed('split', find_feature)
+        leaf_value = profile.timed('leaf', leaf_value)
+        table.profile = profile
+
+    stack = [(0, nrec, -1, 0)] # (start, stop, parent waiting for its right offset, depth)
+    while stack:
+        lo, hi, parent, depth = stack.pop()
+        ti = table.new_node()
+        if parent >= 0:
+            table.right[parent] = ti - parent
+
+        pos = perm[lo:hi]
+        records = pos if rows is None else rows[pos]
+        ys = data_y[records]
+        if return_stats:
+            table.count[ti], table.total[ti] = hi - lo, np.sum(ys)
+        if hi - lo <= leaf_size: # if all data can fit in the same leaf
+            table.set_leaf(ti, leaf_value(ys))
+            leaves[pos] = ti
+            continue
+        if np.max(ys) == np.min(ys): # if all labels are the same
+            table.set_leaf(ti, ys[0])
+            leaves[pos] = ti
+            continue
+        if depth == max_depth:
+            table.set_leaf(ti, leaf_value(ys))
+            leaves[pos] = ti
+            continue
+
+        idx = find_feature(records, ys)
+        if profile is not None:
+            since = time.perf_counter()
+        column = data_x[records, idx]
+        SplitVal = split_value(column)
+        go_left = column <= SplitVal
+        n_left = np.count_nonzero(go_left)
+        if n_left == hi - lo and split_value is not np.median: # e.g. both random draws at the maximum
+            SplitVal = np.median(column)
+            go_left = column <= SplitVal
+            n_left = np.count_nonzero(go_left)
+        if profile is not None:
+            since = profile.lap('median', since)
+        if n_left == hi - lo: # all data on the same side
+            table.set_leaf(ti, leaf_value(ys))
+            leaves[pos] = ti
+            continue
+
+        perm[lo:hi] = np.concatenate((pos[go_left], pos[~go_left]))
+        if profile is not None:
+            profile.lap('partition', since)
+            profile.partition_bytes += 2 * (pos.nbytes + go_left.nbytes)
+        table.set_split(ti, idx, SplitVal)
+        stack.append((lo + n_left, hi, ti, depth + 1)) # right, built after the left subtree
+        stack.append((lo, lo + n_left, -1, depth + 1))
+
+    result = table.result(leaves if return_leaves else None, return_stats)
+    if profile is not None:
+        profile.add_tree(result[0] if isinstance(result, tuple) else result)
+    return result
+
+
+def build_tree_parallel(data_x, data_y, leaf_size, find_feature, pool, n_jobs, leaf_value=np.mean,
+                        return_leaves=False, rows=None, return_stats=False, profile=None, top_find_feature=None,
+                        max_depth=None):
+    """
+    Build the tree build_tree builds, growing the subtrees below the top levels concurrently
+    pool: executor the subtrees are built on, e.g. a ThreadPoolExecutor (numpy
+        releases the GIL in the sorts and reductions of large nodes)
+    n_jobs: the top levels are grown first, until there are more subtrees than n_jobs
+    top_find_feature: find_feature for the top levels, e.g. one scoring blocks of
+        columns on the same pool; find_feature is used inside the subtrees
+    Other arguments and Return: as build_tree, with node for node the same tree
+    Note: a node's subtree only depends on the records reaching it, which the
+    stable partition keeps in their original order, so the subtree grown from
+    the rows of a depth-limited leaf of the top tree is the one build_tree
+    grows there. Subtrees are spliced in depth first, as build_tree lays them
+    out; child offsets are relative, so only the top nodes' offsets change.
+    """
+    if rows is not None:
+        rows = np.asarray(rows)
+    top_depth = int(np.log2(max(n_jobs, 1))) + 1
+    if max_depth is not None and max_depth <= top_depth: # too shallow to split up
+        return build_tree(data_x, data_y, leaf_size, top_find_feature or find_feature, leaf_value, return_leaves,
+                          rows, return_stats, profile, max_depth)
+    sub_depth = None if max_depth is None else max_depth - top_depth
+    top_profile = None if profile is None else pf.Profile()
+    top, top_leaves, top_count, top_total = build_tree(
+        data_x, data_y, leaf_size, top_find_feature or find_feature, leaf_value, return_leaves=True, rows=rows,
+        return_stats=True, profile=top_profile, max_depth=top_depth)
+
+    leaf = top.leaf
+    depth = np.zeros(len(top), dtype=np.intp)
+    for ti in np.flatnonzero(~leaf): # parents come before their children
+        depth[ti + top.left[ti]] = depth[ti + top.right[ti]] = depth[ti] + 1
+    grow = np.flatnonzero(leaf & (depth == top_depth))
+    order = np.argsort(top_leaves, kind='stable') # positions grouped by leaf, in order within each
+    starts = np.searchsorted(top_leaves[order], grow)
+    stops = np.searchsorted(top_leaves[order], grow, side='right')
+
+    def grow_subtree(k):
+        pos = order[starts[k]:stops[k]]
+        sub_profile = None if profile is None else pf.Profile()
+        return build_tree(data_x, data_y, leaf_size, find_feature, leaf_value, return_leaves=True,
+                          rows=pos if rows is None else rows[pos], return_stats=True,
+                          profile=sub_profile, max_depth=sub_depth) + (pos, sub_profile)
+    subtrees = list(pool.map(grow_subtree, range(len(grow))))
+
+    sizes = np.ones(len(top), dtype=np.intp)
+    sizes[grow] = [len(sub[0]) for sub in subtrees]
+    start = np.cumsum(sizes) - sizes # where each top node (or its subtree) starts
+    nodes = np.arange(len(top))
+    top_arrays = (top.feature.astype(np.int32), top.value, start[nodes + top.left] - start,
+                  start[nodes + top.right] - start, leaf, top_count, top_total)
+    parts = [[] for arr in top_arrays]
+    leaves = start[top_leaves].astype(np.int32)
+    prev = 0
+    for ti, (model, sub_leaves, count, total, pos, sub_profile) in zip(grow, subtrees):
+        sub_arrays = (model.feature.astype(np.int32), model.value, model.left, model.right, model.leaf,
+                      count, total)
+        for part, arr, sub in zip(parts, top_arrays, sub_arrays):
+            part.extend((arr[prev:ti], sub))
+        leaves[pos] += sub_leaves
+        prev = ti + 1
+        if profile is not None:
+            profile.merge(sub_profile, counters=False)
+    for part, arr in zip(parts, top_arrays):
+        part.append(arr[prev:])
+    feature, value, left, right, leaf, count, total = [np.concatenate(part) for part in parts]
+    model = tm.TreeModel(feature, value, left, right, leaf)
+    if profile is not None:
+        profile.merge(top_profile, counters=False)
+        profile.add_tree(model)
+
+    result = (model,)
+    if return_leaves:
+        result += (leaves,)
+    if return_stats:
+        result += (count, total)
+    return result if len(result) > 1 else result[0]
+
+
+def kept_nodes(model, count, leaf_size):
+    """
+    Return: boolean mask of the nodes of model that a build with leaf_size keeps
+        (every ancestor is an inner node reached by more than leaf_size records)
+    """
+    leaf = model.leaf
+    kept = np.zeros(len(model), dtype=bool)
+    level = np.asarray(model.roots, dtype=np.intp)
+    while level.size > 0:
+        kept[level] = True
+        inner = level[~leaf[level] & (count[level] > leaf_size)]
+        level = np.concatenate((inner + model.left[inner], inner + model.right[inner]))
+    return kept
+
+
+def prune(model, count, total, leaf_size):
+    """
+    Cut a tree grown with a smaller leaf_size back to the tree leaf_size would grow
+    model, count, total: a tree and its node statistics from build_tree(..., return_stats=True)
+    Return: a compact TreeModel, nodes in the same order as in model
+    Note: a node's split only depends on the records reaching it, so every node
+    reached by more than leaf_size records splits the same way in both builds
+    and the others become leaves predicting the mean of their records. This is
+    exact for DTLearner; for RTLearner the pruned tree is an equally valid
+    random tree, not the one a separate build would draw.
+    """
+    kept = kept_nodes(model, count, leaf_size)
+    cut = kept & ~model.leaf & (count <= leaf_size) # inner nodes that become leaves
+    leaf = (model.leaf | cut)[kept]
+    value = np.where(count <= leaf_size, total / np.maximum(count, 1), model.value)[kept].astype(model.value.dtype)
+    new_index = np.cumsum(kept) - 1
+    nodes = np.flatnonzero(kept)
+    left = np.where(leaf, 0, new_index[nodes + model.left[kept]] - new_index[nodes])
+    right = np.where(leaf, 0, new_index[nodes + model.right[kept]] - new_index[nodes])
+    return tm.TreeModel(model.feature[kept], value, left, right, leaf, new_index[model.roots])
+
+
+def query_leaf_sizes(model, count, total, points, grid):
+    """
+    Predict points with the tree every leaf_size in grid would grow, in one traversal
+    model, count, total: a tree and its node statistics from build_tree(..., return_stats=True)
+    grid: leaf sizes, none smaller than the leaf_size model was grown with
+    Return: (len(grid), rows) array, row k the predictions of prune(..., grid[k])
+    Note: along a path the record counts never grow, so for each leaf_size a
+    row stops at the first node reached by at most leaf_size records
+    """
+    grid = np.asarray(grid)[:, None]
+    nrec = np.shape(points)[0]
+    leaf = model.leaf
+    mean = total / np.maximum(count, 1)
+    pred = np.empty((len(grid), nrec))
+    done = np.zeros((len(grid), nrec), dtype=bool)
+    node = np.repeat(np.asarray(model.roots[:1], dtype=np.intp), nrec)
+    active = np.arange(nrec)
+    while active.size > 0:
+        ti = node[active]
+        stop = (count[ti] <= grid) & ~done[:, active]
+        sel = np.nonzero(stop)
+        pred[sel[0], active[sel[1]]] = mean[ti[sel[1]]]
+        done[:, active] |= stop
+        at_leaf = leaf[ti]
+        rest = ~done[:, active] & at_leaf # leaves reached by more than leaf_size records
+        sel = np.nonzero(rest)
+        pred[sel[0], active[sel[1]]] = model.value[ti[sel[1]]]
+        active, ti = active[~at_leaf], ti[~at_leaf]
+        go_left = points[active, model.feature[ti]] <= model.value[ti]
+        node[active] = ti + np.where(go_left, model.left[ti], model.right[ti])
+    return pred
+
+
+class TreeUpdater(object):
+    """
+    Keeps the training rows of a tree grouped by leaf, so that new rows can be
+    added to the trained TreeModel without rebuilding it
+    model: the TreeModel built from data_x, data_y (a single tree), updated in place
+    split_factor: a leaf is regrown once it holds more than leaf_size x split_factor rows
+    leaves: the leaf of every row of data_x if already known (see build_tree), to skip routing them
+    """
+
+    def __init__(self, model, data_x, data_y, leaf_size, split_factor=2, leaves=None):
+        self.model = model
+        if not model.value.flags.writeable: # e.g. memory-mapped by TreeModel.load
+            model.value = np.array(model.value)
+        self.leaf_size = leaf_size
+        self.split_factor = split_factor
+        self.x = np.array(data_x, dtype=value_dtype(data_x))
+        self.y = np.array(data_y)
+        self.n = len(self.y)
+        if leaves is None:
+            leaves = model.apply(self.x)
+        self.leaf_of = np.array(leaves, dtype=np.int32) # leaf of every stored row
+        self.rows = self.group(self.leaf_of, np.arange(self.n))
+
+    @staticmethod
+    def group(leaves, ids):
+        """
+        Return: dict mapping each leaf in leaves to the array of ids that reached it
+        """
+        order = np.argsort(leaves, kind='stable')
+        uniq, starts = np.unique(leaves[order], return_index=True)
+        return dict(zip(uniq.tolist(), np.split(ids[order], starts[1:])))
+
+    def append(self, new_x, new_y):
+        """
+        Store new rows, doubling the buffers when they fill up
+        Return: the ids of the new rows
+        """
+        m = len(new_y)
+        if self.n + m > len(self.y):
+            size = max(2 * len(self.y), self.n + m)
+            x = np.empty((size, np.shape(self.x)[1]), dtype=self.x.dtype)
+            y = np.empty(size, dtype=np.result_type(self.y, new_y))
+            leaf_of = np.empty(size, dtype=np.int32)
+            x[:self.n], y[:self.n], leaf_of[:self.n] = self.x[:self.n], self.y[:self.n], self.leaf_of[:self.n]
+            self.x, self.y, self.leaf_of = x, y, leaf_of
+        self.x[self.n:self.n + m] = new_x
+        self.y[self.n:self.n + m] = new_y
+        self.n += m
+        return np.arange(self.n - m, self.n)
+
+    def update(self, new_x, new_y, feature_finder, leaf_value=np.mean, split_value=np.median):
+        """
+        Add new rows to the tree
+        feature_finder: called with the records of a leaf being regrown, returns
+            the find_feature callable build_tree expects for them
+        leaf_value: turns the labels reaching a leaf into its prediction
+        split_value: as for build_tree, used when regrowing leaves
+        Note: every new row is routed to its leaf (O(depth)) and only the leaves
+        it reaches are touched: their value is recomputed from their rows, and a
+        leaf holding more than leaf_size x split_factor rows is replaced by a
+        subtree built from its rows alone.
+        """
+        ids = self.append(new_x, new_y)
+        grow = []
+        for leaf, idx in self.group(self.model.apply(np.asarray(new_x)), ids).items():
+            rows = np.concatenate((self.rows.get(leaf, ids[:0]), idx))
+            self.rows[leaf] = rows
+            self.leaf_of[idx] = leaf
+            if len(rows) > self.leaf_size * self.split_factor:
+                grow.append(leaf)
+            else:
+                self.model.value[leaf] = leaf_value(self.y[rows])
+        for leaf in grow:
+            self.regrow(leaf, feature_finder, leaf_value, split_value)
+
+    def regrow(self, leaf, feature_finder, leaf_value=np.mean, split_value=np.median):
+        """
+        Replace a leaf by the tree build_tree grows from the rows it holds
+        """
+        rows = self.rows.pop(leaf)
+        data_x, data_y = self.x[rows], self.y[rows]
+        subtree = build_tree(data_x, data_y, self.leaf_size, feature_finder(data_x), leaf_value,
+                             split_value=split_value)
+        if len(subtree) == 1: # the rows cannot be split
+            self.model.value[leaf] = subtree.value[0]
+            self.rows[leaf] = rows
+            return
+        start = self.model.graft(leaf, subtree)
+        self.leaf_of[rows] = start + subtree.apply(data_x) - 1
+        self.rows.update(self.group(self.leaf_of[rows], rows))
+
+    def leaves(self):
+        """
+        Return: the leaf of every stored row (training rows first, then updates in order)
+        """
+        return self.leaf_of[:self.n]